@@ -0,0 +1,283 @@
+"""Benchmarks for the world generation pipeline.
+
+Runs each stage (and the whole pipeline) with a fixed seed across map
+sizes, every case in a fresh process so peak RSS is per case. Results
+are written as JSON and can be compared with a stored baseline:
+
+    python benchmark.py --sizes 100,250,500 --output bench.json
+    python benchmark.py --baseline bench.json --output current.json --time-threshold 0.15
+
+The exit status is 1 when any case regresses past its threshold.
+
+    python benchmark.py --check-parallel
+
+instead checks that multi-process renders, with a cold and a warm stage
+cache, are pixel-identical to the serial render (exit status 1 if not).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from queue import Empty
+
+import numpy as np
+
+from tracing import current_rss
+
+TILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Tiles')
+STAGES = ['noise', 'classify', 'rivers', 'settlements', 'roads', 'composite', 'pipeline']
+DEFAULT_SIZES = [100, 250, 500, 1000, 2000]
+BAND_ROWS = 64  # Rendering is banded so large maps fit in memory
+RSS_NOISE_KB = 1024  # Smaller stage RSS changes are page-level noise, never regressions
+
+
+def _prepare(stage, size, seed):
+    """Build the generator and the stage's inputs; returns the timed callable."""
+    from worldgen import WorldGenerator
+
+    generator = WorldGenerator(TILES_PATH, output_size=(size, size), seed=seed)
+    if stage == 'noise':
+        return lambda: generator.generate_noise_map(generator.noise_scale, base=0)
+    if stage == 'pipeline':
+        out = tempfile.TemporaryDirectory()  # Removed when the case process exits
+        return lambda: generator.save_world(os.path.join(out.name, 'world.png'), band_rows=BAND_ROWS)
+
+    elevation, temperature = (generator.generate_noise_map(generator.noise_scale, base=b) for b in (0, 1))
+    if stage == 'classify':
+        return lambda: generator.classify_world(elevation, temperature)
+    if stage == 'rivers':
+        return lambda: generator.generate_rivers(elevation, generator.num_rivers)
+
+    layers = generator.classify_world(elevation, temperature)
+    river_mask, _ = generator.generate_rivers(elevation, generator.num_rivers)
+    if stage == 'settlements':
+        return lambda: generator.place_settlements(layers, river_mask)
+
+    settlements = dict(generator.place_settlements(layers, river_mask).points)
+    if stage == 'roads':
+        return lambda: generator.generate_roads(settlements, elevation)
+    if stage == 'composite':
+        world = generator.plan_world()
+
+        def composite():
+            for y0 in range(0, size, BAND_ROWS):
+                generator.composite_world(world, (y0, min(y0 + BAND_ROWS, size)))
+        return composite
+    raise ValueError(f'unknown stage {stage!r}')
+
+
+def _reset_peak_rss():
+    # Linux only: restart the VmHWM high-water mark so it covers what follows
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _run_case(stage, size, seed, repeat, queue):
+    try:
+        run = _prepare(stage, size, seed)
+        # The stage's own memory: peak during the timed runs over what setup left resident
+        setup_rss = (current_rss() or 0) // 1024
+        _reset_peak_rss()
+
+        # Timed runs without tracing; keep the best of repeat
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        peak_rss = _peak_rss_kb()
+
+        # One traced run for allocation figures (tracing slows it down)
+        blocks = sys.getallocatedblocks()
+        tracemalloc.start()
+        run()
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        queue.put({
+            'stage': stage,
+            'size': size,
+            'wall_s': min(times),
+            'peak_rss_kb': peak_rss,
+            'stage_rss_kb': max(0, peak_rss - setup_rss),
+            'traced_peak_bytes': traced_peak,
+            'allocated_blocks': sys.getallocatedblocks() - blocks
+        })
+    except Exception as e:
+        queue.put({'stage': stage, 'size': size, 'error': repr(e)})
+
+
+def check_parallel(size=64, seed=1234, workers=2, band_rows=8):
+    """Compare parallel renders with the serial one; returns the mismatching cases.
+
+    Every case renders twice into the same stage cache, so the second run
+    composites from cached layers rather than ones generated on the pool.
+    """
+    from PIL import Image
+    from worldgen import WorldGenerator
+
+    failures = []
+    with tempfile.TemporaryDirectory() as out:
+        def render(name, **options):
+            filename = os.path.join(out, f'{name}.png')
+            WorldGenerator(TILES_PATH, output_size=(size, size), seed=seed, **options).save_world(
+                filename, band_rows=band_rows)
+            return np.asarray(Image.open(filename).convert('RGBA'))
+
+        expected = render('serial')
+        cache_dir = os.path.join(out, 'cache')
+        for run in ('cold', 'warm'):
+            image = render(f'parallel_{run}', workers=workers, cache_dir=cache_dir)
+            if not np.array_equal(image, expected):
+                failures.append({'case': f'{run} cache, {workers} workers',
+                                 'differing_pixels': float((image != expected).any(axis=2).mean())})
+    return failures
+
+
+def _case_result(process, queue, stage, size, poll=1.0):
+    # A case killed without reporting (e.g. by the OOM killer) must not hang the suite
+    while True:
+        try:
+            return queue.get(timeout=poll)
+        except Empty:
+            if not process.is_alive():
+                try:
+                    return queue.get(timeout=poll)  # Posted just before exiting
+                except Empty:
+                    return {'stage': stage, 'size': size,
+                            'error': f'case process exited with code {process.exitcode} without a result'}
+
+
+def run_benchmarks(stages, sizes, seed=1234, repeat=1):
+    # Spawn, not fork, so every case starts from a clean interpreter
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for size in sizes:
+        for stage in stages:
+            queue = context.Queue()
+            process = context.Process(target=_run_case, args=(stage, size, seed, repeat, queue))
+            process.start()
+            result = _case_result(process, queue, stage, size)
+            process.join()
+            results.append(result)
+            if 'error' in result:
+                print(f'{stage:>12} {size:>5}  failed: {result["error"]}')
+            else:
+                print(f'{stage:>12} {size:>5}  {result["wall_s"]:9.3f}s  '
+                      f'{result["stage_rss_kb"] / 1024:8.1f} MB')
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'seed': seed,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')
+        },
+        'results': results
+    }
+
+
+def compare(current, baseline, time_threshold=0.2, memory_threshold=0.2):
+    """List regressions of current against baseline.
+
+    A case regresses when its wall time or the peak RSS the stage adds
+    over its setup exceeds the baseline value by more than the given
+    fraction.
+    """
+    previous = {(r['stage'], r['size']): r for r in baseline['results'] if 'error' not in r}
+    regressions = []
+    for result in current['results']:
+        old = previous.get((result['stage'], result['size']))
+        if old is None or 'error' in result:
+            continue
+        for metric, threshold in (('wall_s', time_threshold), ('stage_rss_kb', memory_threshold)):
+            slack = RSS_NOISE_KB if metric == 'stage_rss_kb' else 0
+            if old.get(metric) and result[metric] > old[metric] * (1 + threshold) + slack:
+                regressions.append({
+                    'stage': result['stage'],
+                    'size': result['size'],
+                    'metric': metric,
+                    'baseline': old[metric],
+                    'current': result[metric],
+                    'ratio': result[metric] / old[metric]
+                })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma-separated map sides')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='comma-separated stages: ' + ', '.join(STAGES))
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--repeat', type=int, default=1, help='timed runs per case (best is kept)')
+    parser.add_argument('--output', default='bench.json', help='where to write the results')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--time-threshold', type=float, default=0.2)
+    parser.add_argument('--memory-threshold', type=float, default=0.2)
+    parser.add_argument('--check-parallel', action='store_true',
+                        help='only check parallel renders against the serial render')
+    args = parser.parse_args(argv)
+
+    if args.check_parallel:
+        failures = check_parallel(seed=args.seed)
+        for failure in failures:
+            print(f'MISMATCH {failure["case"]}: {failure["differing_pixels"]:.1%} of pixels differ')
+        if failures:
+            return 1
+        print('Parallel renders match')
+        return 0
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    stages = args.stages.split(',')
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f'unknown stages: {", ".join(sorted(unknown))}')
+
+    # Read the baseline first: writing the results must never replace it
+    baseline = None
+    if args.baseline:
+        if os.path.abspath(args.baseline) == os.path.abspath(args.output):
+            parser.error('--output must differ from --baseline')
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = run_benchmarks(stages, sizes, args.seed, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Saved: {args.output}')
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.time_threshold, args.memory_threshold)
+        for r in regressions:
+            print(f'REGRESSION {r["stage"]} {r["size"]} {r["metric"]}: '
+                  f'{r["baseline"]:.3f} -> {r["current"]:.3f} ({r["ratio"]:.2f}x)')
+        if regressions:
+            return 1
+        print('No regressions')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""Incremental build of every generated asset in this directory.
+
+Each output is a target with declared inputs: the generator's source
+(and the local modules it imports), its parameters and the tile files
+it reads. A target is skipped when the hash of its inputs matches the
+previous build and its outputs are still on disk untouched; the rest
+run in parallel on a process pool.
+
+    python build.py                  # build what changed
+    python build.py world --force    # rebuild one target regardless
+"""
+import argparse
+import ast
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = os.path.join(HERE, '.build_state.json')
+STAGE_CACHE = os.path.join(HERE, '.stage_cache')
+
+
+def _path(name):
+    return os.path.join(HERE, name)
+
+
+def build_world(params):
+    from worldgen import WorldGenerator
+
+    generator = WorldGenerator(
+        _path('Tiles'),
+        output_size=tuple(params['size']),
+        tile_size=params['tile_size'],
+        seed=params['seed'],
+        cache_dir=STAGE_CACHE  # Reuses planned stages when only rendering inputs change
+    )
+    filename = _path(params['output'])
+    generator.save_world(filename, band_rows=params['band_rows'])
+    return [filename, os.path.splitext(filename)[0] + '.mwld']
+
+
+def build_navigation(params):
+    from navigationgen import create_navigation_sprites
+    return create_navigation_sprites(_path(params['output_dir']), params['size'], params['atlas'])
+
+
+def build_ui(params):
+    from uigen import create_navigation_ui
+    return create_navigation_ui(_path(params['output_dir']), params['atlas'])
+
+
+# name -> action, source module, parameters and data files read
+TARGETS = {
+    'world': {
+        'action': build_world,
+        'module': 'worldgen',
+        'params': {'output': 'world_map.png', 'size': [230, 230], 'tile_size': 16,
+                   'seed': 1234, 'band_rows': 64},
+        'files': ['Tilemap/tilemap_packed.png', 'Tiles/*.png']
+    },
+    'navigation': {
+        'action': build_navigation,
+        'module': 'navigationgen',
+        'params': {'output_dir': 'Navigation', 'size': 16, 'atlas': False},
+        'files': []
+    },
+    'ui': {
+        'action': build_ui,
+        'module': 'uigen',
+        'params': {'output_dir': 'NavigationUI', 'atlas': False},
+        'files': []
+    }
+}
+
+
+def local_sources(module):
+    """Source files of module and every module in this directory it imports."""
+    seen = set()
+    pending = [module]
+    while pending:
+        name = pending.pop()
+        filename = _path(name + '.py')
+        if name in seen or not os.path.exists(filename):
+            continue
+        seen.add(name)
+        with open(filename, 'rb') as f:
+            tree = ast.parse(f.read(), filename)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name.split('.')[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                pending.append(node.module.split('.')[0])
+    return sorted(_path(name + '.py') for name in seen)
+
+
+def input_hash(name, target):
+    """Hash of everything the target reads: sources, parameters and data files."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps({'target': name, 'params': target['params']}, sort_keys=True).encode('utf-8'))
+    files = local_sources(target['module'])
+    for pattern in target['files']:
+        files.extend(sorted(glob.glob(_path(pattern))))
+    for filename in files:
+        digest.update(os.path.relpath(filename, HERE).encode('utf-8'))
+        with open(filename, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def _stamp(filename):
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def up_to_date(record, key):
+    # Outputs deleted or edited since the last build count as stale
+    if not record or record['hash'] != key:
+        return False
+    for filename, stamp in record['outputs'].items():
+        if not os.path.exists(_path(filename)) or _stamp(_path(filename)) != stamp:
+            return False
+    return True
+
+
+def _run_target(name):
+    # Worker entry point: generators write relative to this directory
+    os.chdir(HERE)
+    sys.path.insert(0, HERE)
+    start = time.perf_counter()
+    outputs = TARGETS[name]['action'](TARGETS[name]['params'])
+    return outputs, time.perf_counter() - start
+
+
+def load_state():
+    try:
+        with open(STATE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    temp = STATE_FILE + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(temp, STATE_FILE)
+
+
+def build(names, force=False, jobs=None):
+    """Build the named targets; returns {name: 'skipped' | 'built' | error text}."""
+    state = load_state()
+    keys = {name: input_hash(name, TARGETS[name]) for name in names}
+    stale = [name for name in names if force or not up_to_date(state.get(name), keys[name])]
+    results = {name: 'skipped' for name in names if name not in stale}
+    for name in results:
+        print(f'{name:>12}  up to date')
+
+    if stale:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs or min(len(stale), os.cpu_count())) as pool:
+            futures = {pool.submit(_run_target, name): name for name in stale}
+            for future in concurrent.futures.as_completed(futures):
+                name = futures[future]
+                try:
+                    outputs, seconds = future.result()
+                except Exception as e:
+                    results[name] = repr(e)
+                    state.pop(name, None)
+                    print(f'{name:>12}  failed: {e!r}')
+                    continue
+                results[name] = 'built'
+                state[name] = {
+                    'hash': keys[name],
+                    'outputs': {os.path.relpath(f, HERE): _stamp(f) for f in outputs}
+                }
+                print(f'{name:>12}  built in {seconds:.2f}s ({len(outputs)} files)')
+        save_state(state)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('targets', nargs='*', help='targets to build: ' + ', '.join(TARGETS) + ' (default all)')
+    parser.add_argument('--force', action='store_true', help='rebuild even if up to date')
+    parser.add_argument('--jobs', type=int, help='worker processes (default one per stale target)')
+    args = parser.parse_args(argv)
+
+    names = args.targets or list(TARGETS)
+    unknown = set(names) - set(TARGETS)
+    if unknown:
+        parser.error(f'unknown targets: {", ".join(sorted(unknown))}')
+    results = build(names, args.force, args.jobs)
+    return 1 if any(r not in ('skipped', 'built') for r in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_CHUNK_SIZE = 64
+
+
+def _buffers(value):
+    # The arrays that own the memory behind every array in a nested dict
+    if isinstance(value, np.ndarray):
+        while isinstance(value.base, np.ndarray):
+            value = value.base
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _buffers(item)
+
+
+def chunk_nbytes(chunk, world=None):
+    """Bytes of memory a chunk keeps alive.
+
+    Each buffer is counted once, whole, however many of the chunk's arrays
+    look into it; buffers of the planned world (views of its layers) are
+    not the chunk's and are left out.
+    """
+    shared = {id(buffer) for buffer in _buffers(world)} if world is not None else set()
+    owned = {id(buffer): buffer for buffer in _buffers(chunk) if id(buffer) not in shared}
+    return sum(buffer.nbytes for buffer in owned.values())
+
+
+class ChunkCache:
+    """Lazily generated, LRU-cached chunks of a world.
+
+    Chunk (cx, cy) covers tiles [cx * size, (cx + 1) * size) on both axes
+    and comes from WorldGenerator.generate_chunk, so any chunk can be
+    served without generating the rest of the map. Chunks are kept until
+    the cached arrays pass max_bytes, then dropped least recently used
+    first. With a planned world the chunks carry rivers, roads and
+    settlements and must lie on the map; without one they show terrain
+    only and chunk coordinates are unbounded.
+    """
+
+    def __init__(self, generator, size=DEFAULT_CHUNK_SIZE, max_bytes=256 << 20, world=None, render=True):
+        self.generator = generator
+        self.size = size
+        self.max_bytes = max_bytes
+        self.world = world
+        self.render = render
+        self.chunks = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def __contains__(self, key):
+        return key in self.chunks
+
+    def bounds(self, cx, cy):
+        x0, y0 = cx * self.size, cy * self.size
+        x1, y1 = x0 + self.size, y0 + self.size
+        if self.world is not None:
+            width, height = self.generator.output_size
+            x1, y1 = min(x1, width), min(y1, height)
+        return x0, y0, x1, y1
+
+    def get(self, cx, cy):
+        key = (cx, cy)
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            self.chunks.move_to_end(key)
+            self.hits += 1
+            return chunk
+        self.misses += 1
+        chunk = self.generator.generate_chunk(*self.bounds(cx, cy), world=self.world, render=self.render)
+        self.chunks[key] = chunk
+        self.nbytes += chunk_nbytes(chunk, self.world)
+        self.evict()
+        return chunk
+
+    def evict(self):
+        # Always keep the newest chunk, even if it alone is over budget
+        while self.nbytes > self.max_bytes and len(self.chunks) > 1:
+            _, chunk = self.chunks.popitem(last=False)
+            self.nbytes -= chunk_nbytes(chunk, self.world)
+
+    def clear(self):
+        self.chunks.clear()
+        self.nbytes = 0
+
+    def region(self, x0, y0, x1, y1):
+        """Rendered RGBA pixels of tiles [x0, x1) x [y0, y1), from whole chunks."""
+        if not self.render:
+            raise ValueError('region needs rendered chunks; this cache was made with render=False')
+        tile = self.generator.tile_size
+        image = np.empty(((y1 - y0) * tile, (x1 - x0) * tile, 4), dtype=np.uint8)
+        for cy in range(y0 // self.size, -(-y1 // self.size)):
+            for cx in range(x0 // self.size, -(-x1 // self.size)):
+                cx0, cy0, cx1, cy1 = self.bounds(cx, cy)
+                ox0, oy0 = max(x0, cx0), max(y0, cy0)
+                ox1, oy1 = min(x1, cx1), min(y1, cy1)
+                if ox0 >= ox1 or oy0 >= oy1:
+                    continue
+                chunk = self.get(cx, cy)['image']
+                image[(oy0 - y0) * tile:(oy1 - y0) * tile, (ox0 - x0) * tile:(ox1 - x0) * tile] = \
+                    chunk[(oy0 - cy0) * tile:(oy1 - cy0) * tile, (ox0 - cx0) * tile:(ox1 - cx0) * tile]
+        return image
+
+    def cell(self, x, y):
+        """Terrain layers of one tile: (elevation, temperature, terrain id)."""
+        cx, cy = x // self.size, y // self.size
+        chunk = self.get(cx, cy)
+        lx, ly = x - cx * self.size, y - cy * self.size
+        return (float(chunk['elevation'][lx, ly]), float(chunk['temperature'][lx, ly]),
+                int(chunk['layers']['terrain'][lx, ly]))
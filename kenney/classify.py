@@ -0,0 +1,89 @@
+import numpy as np
+from fbm import cell_random
+
+# Terrain IDs stored in the uint8 terrain grid; order is part of the map format
+TERRAIN_TYPES = ['water', 'mountain', 'sand', 'snow', 'tundra', 'forest', 'grass']
+TERRAIN_IDS = {name: i for i, name in enumerate(TERRAIN_TYPES)}
+
+SETTLEMENT_TYPES = ['village', 'city', 'outpost']
+SETTLEMENT_IDS = {name: i for i, name in enumerate(SETTLEMENT_TYPES)}
+
+RESOURCE_TYPES = ['metal', 'gems', 'wood']
+
+# Elevation thresholds shared by every stage
+WATER_LEVEL = -0.2
+MOUNTAIN_LEVEL = 0.6
+
+# Independent per-cell random streams (see fbm.cell_random)
+FOREST_STREAM = 1
+METAL_STREAM = 2
+GEMS_STREAM = 3
+WOOD_STREAM = 4
+CITY_STREAM = 5
+
+
+def classify_biomes(elevation, temperature, forest_roll):
+    terrain = np.full(elevation.shape, TERRAIN_IDS['grass'], dtype=np.uint8)
+    terrain[forest_roll < 0.3] = TERRAIN_IDS['forest']  # 30% forest in temperate areas
+    terrain[temperature < 0] = TERRAIN_IDS['tundra']
+    terrain[temperature < -0.3] = TERRAIN_IDS['snow']
+    terrain[temperature > 0.7] = TERRAIN_IDS['sand']
+    terrain[elevation < WATER_LEVEL] = TERRAIN_IDS['water']
+    terrain[elevation > MOUNTAIN_LEVEL] = TERRAIN_IDS['mountain']
+    return terrain
+
+
+def coast_mask(elevation):
+    # Land cells with at least one 4-neighbour of water, via shifted views
+    water = elevation < WATER_LEVEL
+    near_water = np.zeros_like(water)
+    near_water[:-1, :] |= water[1:, :]
+    near_water[1:, :] |= water[:-1, :]
+    near_water[:, :-1] |= water[:, 1:]
+    near_water[:, 1:] |= water[:, :-1]
+    return (elevation > WATER_LEVEL) & near_water
+
+
+def resource_masks(elevation, temperature, metal_roll, gems_roll, wood_roll):
+    mountains = elevation > 0.5
+    metal = mountains & (metal_roll < 0.1)             # 10% chance
+    gems = mountains & ~metal & (gems_roll < 0.05)     # 5% chance
+    forested = ~mountains & (elevation > 0) & (temperature > 0)
+    wood = forested & (wood_roll < 0.15)               # 15% chance
+    return {'metal': metal, 'gems': gems, 'wood': wood}
+
+
+def settlement_classes(elevation, temperature, city_roll):
+    # Outposts on high ground, some cities in warm regions, villages elsewhere
+    classes = np.full(elevation.shape, SETTLEMENT_IDS['village'], dtype=np.uint8)
+    classes[(temperature > 0.3) & (city_roll < 0.3)] = SETTLEMENT_IDS['city']
+    classes[elevation > 0.4] = SETTLEMENT_IDS['outpost']
+    return classes
+
+
+def classify_terrain(elevation, temperature, seed, origin=(0, 0)):
+    """Classify whole elevation/temperature arrays in one pass.
+
+    Returns a dict with the uint8 'terrain' grid (TERRAIN_IDS), the uint8
+    'settlement_type' grid (SETTLEMENT_IDS), boolean 'coast' and
+    'buildable' masks and a 'resources' dict of boolean masks. Random
+    choices come from per-cell hash streams, so a window classified on its
+    own matches the same window of the full map.
+    """
+    width, height = elevation.shape
+    xs = np.arange(origin[0], origin[0] + width)
+    ys = np.arange(origin[1], origin[1] + height)
+
+    def roll(stream):
+        return cell_random(seed, stream, xs, ys)
+
+    return {
+        'terrain': classify_biomes(elevation, temperature, roll(FOREST_STREAM)),
+        'settlement_type': settlement_classes(elevation, temperature, roll(CITY_STREAM)),
+        'coast': coast_mask(elevation),
+        'buildable': (elevation > WATER_LEVEL) & (elevation < MOUNTAIN_LEVEL),
+        'resources': resource_masks(
+            elevation, temperature,
+            roll(METAL_STREAM), roll(GEMS_STREAM), roll(WOOD_STREAM)
+        )
+    }
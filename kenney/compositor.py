@@ -0,0 +1,136 @@
+import hashlib
+
+import numpy as np
+from fbm import cell_hash
+
+# Hash streams used to pick tile variants, one per rendered layer
+BASE_STREAM = 101
+RIVER_STREAM = 102
+ROAD_STREAM = 103
+SETTLEMENT_STREAM = 104
+
+
+class TileAtlas:
+    """All tiles stacked into one (n_tiles, size, size, 4) uint8 array.
+
+    sheet holds the decoded tiles and groups maps each of the generator's
+    tile categories ('grass', 'settlement/city', 'resources/metal', ...)
+    to sheet indices. Atlas index 0 is a fully transparent tile, which
+    empty categories fall back to.
+    """
+
+    def __init__(self, sheet, groups, tile_size):
+        self.tile_size = tile_size
+        blank = np.zeros((1, tile_size, tile_size, 4), dtype=np.uint8)
+        self.tiles = np.concatenate([blank, sheet])
+        self.group_names = list(groups)
+        self.group_ids = {name: i for i, name in enumerate(self.group_names)}
+
+        # Flattened variant table: group g owns members[offsets[g]:offsets[g] + counts[g]]
+        members = [[i + 1 for i in groups[n]] or [0] for n in self.group_names]
+        self.counts = np.array([len(m) for m in members])
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+        self.members = np.concatenate(members)
+        self.empty = np.array([not groups[n] for n in self.group_names])
+
+        # Identifies the tileset contents, for caching anything rendered from it
+        digest = hashlib.sha256(self.tiles.tobytes())
+        digest.update(repr(sorted(groups.items())).encode('utf-8'))
+        self.digest = digest.hexdigest()
+
+    def downsample(self, factor):
+        """Copy of the atlas with every tile box-filtered down by factor.
+
+        Colours are averaged weighted by alpha, so half-transparent overlay
+        tiles keep their hue at small sizes. factor must divide tile_size.
+        """
+        size = self.tile_size // factor
+        blocks = self.tiles[1:].reshape(-1, size, factor, size, factor, 4).astype(np.float64)
+        alpha = blocks[..., 3:].sum(axis=(2, 4))
+        colour = (blocks[..., :3] * blocks[..., 3:]).sum(axis=(2, 4))
+        sheet = np.zeros(alpha.shape[:3] + (4,))
+        np.divide(colour, alpha, out=sheet[..., :3], where=alpha > 0)
+        sheet[..., 3:] = alpha / (factor * factor)
+        groups = {
+            name: [i - 1 for i in self.members[self.offsets[g]:self.offsets[g] + self.counts[g]]]
+            if not self.empty[g] else []
+            for g, name in enumerate(self.group_names)
+        }
+        return TileAtlas(np.round(sheet).astype(np.uint8), groups, size)
+
+    def composite_palette(self, overlay_layers=3, max_colours=256):
+        """Every colour a composite of these tiles can contain, as (n, 4) RGBA.
+
+        A composited pixel is a tile pixel with up to overlay_layers tile
+        pixels blended over it (see overlay). Opaque and fully transparent
+        overlay pixels add no new colours, so only the partly transparent
+        ones are blended against the colours found so far. Returns None
+        when there are more than max_colours.
+        """
+        pixels = self.tiles.reshape(-1, 4)
+        colours = np.unique(pixels, axis=0)
+        partial = np.unique(pixels[(pixels[:, 3] > 0) & (pixels[:, 3] < 255)], axis=0)
+        for _ in range(overlay_layers if len(partial) else 0):
+            if len(colours) > max_colours:
+                return None
+            src = partial[:, None].astype(np.uint16)
+            dst = colours[None].astype(np.uint16)
+            alpha = src[..., 3:]
+            inverse = 255 - alpha
+            blended = np.empty(np.broadcast_shapes(src.shape, dst.shape), dtype=np.uint16)
+            blended[..., :3] = (src[..., :3] * alpha + dst[..., :3] * inverse + 127) // 255
+            blended[..., 3:] = alpha + (dst[..., 3:] * inverse + 127) // 255
+            colours = np.unique(np.concatenate([colours, blended.reshape(-1, 4).astype(np.uint8)]), axis=0)
+        return colours if len(colours) <= max_colours else None
+
+    def group(self, name):
+        return self.group_ids[name]
+
+    def has_tiles(self, name):
+        return not self.empty[self.group_ids[name]]
+
+    def select(self, groups, seed, stream, origin=(0, 0)):
+        """Pick an atlas index for every cell of a (width, height) group-ID grid.
+
+        The variant is a hash of the seed and the cell's absolute position,
+        so the same cell always gets the same tile.
+        """
+        width, height = groups.shape
+        h = cell_hash(
+            seed, stream,
+            np.arange(origin[0], origin[0] + width),
+            np.arange(origin[1], origin[1] + height)
+        )
+        counts = self.counts[groups].astype(np.uint64)
+        variant = (h % counts).astype(np.int64)
+        return self.members[self.offsets[groups] + variant]
+
+    def render(self, indices):
+        # (w, h) index grid -> (w, h, T, T, 4) -> (h*T, w*T, 4) image rows
+        width, height = indices.shape
+        size = self.tile_size
+        cells = self.tiles[indices]
+        return cells.transpose(1, 2, 0, 3, 4).reshape(height * size, width * size, 4)
+
+    def overlay(self, image, mask, indices):
+        """Alpha-blend tiles over the masked cells of a rendered image in place.
+
+        indices is a (width, height) atlas index grid (only masked cells are
+        read). All masked cells are blended in one batched operation.
+        """
+        xs, ys = np.nonzero(mask)
+        if not len(xs):
+            return image
+        width, height = mask.shape
+        size = self.tile_size
+        view = image.reshape(height, size, width, size, 4)
+
+        src = self.tiles[indices[xs, ys]].astype(np.uint16)
+        dst = view[ys, :, xs].astype(np.uint16)
+        alpha = src[..., 3:]
+        inverse = 255 - alpha
+        out = np.empty_like(src)
+        out[..., :3] = (src[..., :3] * alpha + dst[..., :3] * inverse + 127) // 255
+        out[..., 3:] = alpha + (dst[..., 3:] * inverse + 127) // 255
+        view[ys, :, xs] = out.astype(np.uint8)
+        return image
@@ -0,0 +1,134 @@
+from functools import lru_cache
+
+import numpy as np
+
+# Gradient directions used by the 2D Perlin lattice (same set as improved Perlin noise)
+GRADIENTS = np.array([
+    (1, 1), (-1, 1), (1, -1), (-1, -1),
+    (1, 0), (-1, 0), (0, 1), (0, -1)
+], dtype=np.float64)
+
+
+@lru_cache(maxsize=256)
+def permutation_table(seed, base=0):
+    """Build the 512-entry permutation table for one noise layer.
+
+    Tables are memoized (and read-only), so a long-running process only
+    builds each seed's tables once.
+    """
+    rng = np.random.default_rng([seed, base])
+    perm = rng.permutation(256)
+    table = np.concatenate([perm, perm])
+    table.flags.writeable = False
+    return table
+
+
+def _fade(t):
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+
+def _lattice(coords, period):
+    # Split coordinates into wrapped lattice indices and fractional offsets
+    cell = np.floor(coords)
+    frac = coords - cell
+    cell = cell.astype(np.int64)
+    i0 = np.mod(cell, period) & 255
+    i1 = np.mod(cell + 1, period) & 255
+    return i0, i1, frac
+
+
+def perlin2(xs, ys, perm, periodx, periody):
+    """Evaluate tileable Perlin noise on the grid spanned by xs and ys.
+
+    xs and ys are 1D arrays of lattice coordinates; the result has shape
+    (len(xs), len(ys)) and is indexed [x, y] like the generator's maps.
+    The field repeats every periodx/periody lattice cells.
+    """
+    x0, x1, fx = _lattice(xs, periodx)
+    y0, y1, fy = _lattice(ys, periody)
+
+    # Hash each lattice corner once per axis, then broadcast over the grid
+    hx0 = perm[x0][:, None]
+    hx1 = perm[x1][:, None]
+    g00 = perm[hx0 + y0[None, :]] & 7
+    g10 = perm[hx1 + y0[None, :]] & 7
+    g01 = perm[hx0 + y1[None, :]] & 7
+    g11 = perm[hx1 + y1[None, :]] & 7
+
+    fx = fx[:, None]
+    fy = fy[None, :]
+    gx, gy = GRADIENTS[:, 0], GRADIENTS[:, 1]
+    n00 = gx[g00] * fx + gy[g00] * fy
+    n10 = gx[g10] * (fx - 1) + gy[g10] * fy
+    n01 = gx[g01] * fx + gy[g01] * (fy - 1)
+    n11 = gx[g11] * (fx - 1) + gy[g11] * (fy - 1)
+
+    u = _fade(fx)
+    v = _fade(fy)
+    nx0 = n00 + u * (n10 - n00)
+    nx1 = n01 + u * (n11 - n01)
+    return nx0 + v * (nx1 - nx0)
+
+
+def fbm_noise(shape, seed, base=0, scale=100.0, octaves=6, persistence=0.5,
+              lacunarity=2.0, repeatx=None, repeaty=None, origin=(0, 0)):
+    """Fill a whole (width, height) array with fractal Brownian motion noise.
+
+    Identical parameters always give identical output. Every octave's
+    frequency is snapped so the field wraps exactly every repeatx/repeaty
+    cells (defaulting to the map size), which keeps the map tileable.
+    origin offsets the sampled window, so any sub-rectangle of the map can
+    be evaluated on its own and still line up with its neighbours.
+    """
+    width, height = shape
+    repeatx = repeatx or width
+    repeaty = repeaty or height
+    perm = permutation_table(seed, base)
+
+    xs = np.arange(origin[0], origin[0] + width, dtype=np.float64)
+    ys = np.arange(origin[1], origin[1] + height, dtype=np.float64)
+
+    total = np.zeros((width, height))
+    amplitude = 1.0
+    max_amplitude = 0.0
+    frequency = 1.0 / scale
+    for _ in range(octaves):
+        periodx = max(1, int(round(repeatx * frequency)))
+        periody = max(1, int(round(repeaty * frequency)))
+        total += amplitude * perlin2(
+            xs * periodx / repeatx,
+            ys * periody / repeaty,
+            perm, periodx, periody
+        )
+        max_amplitude += amplitude
+        amplitude *= persistence
+        frequency *= lacunarity
+
+    return total / max_amplitude
+
+
+def _mix64(h):
+    # splitmix64 finaliser; uint64 arithmetic wraps, which is what we want
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def cell_hash(seed, stream, xs, ys):
+    """Hash every (x, y) cell of the grid spanned by xs and ys to a uint64.
+
+    The value depends only on the seed, the stream id and the absolute cell
+    coordinates, so any window of the map can be drawn on its own and the
+    result never depends on evaluation order.
+    """
+    xs = np.asarray(xs, dtype=np.int64).astype(np.uint64)
+    ys = np.asarray(ys, dtype=np.int64).astype(np.uint64)
+    key = np.array([seed & 0xFFFFFFFFFFFFFFFF, stream], dtype=np.uint64)
+    key = _mix64(key[:1] + key[1:] * np.uint64(0x9E3779B97F4A7C15))
+    hx = _mix64(key + xs * np.uint64(0xD1B54A32D192ED03))
+    return _mix64(hx[:, None] ^ (ys[None, :] * np.uint64(0xABC98388FB8FAC03)))
+
+
+def cell_random(seed, stream, xs, ys):
+    """Uniform [0, 1) draws for every cell, one independent stream per use."""
+    return (cell_hash(seed, stream, xs, ys) >> np.uint64(11)) * (1.0 / (1 << 53))
@@ -0,0 +1,134 @@
+import numpy as np
+
+from classify import SETTLEMENT_TYPES, RESOURCE_TYPES
+from roads import SQRT2, movement_cost
+
+NO_OWNER = 0xFFFF
+DISTANCE_SCALE = 8      # Stored distances are in 1/8 tiles
+MAX_DISTANCE = 0xFFFF   # Stored where no feature is reachable
+EPSILON = 1e-9          # Smaller gains are float noise between equal routes
+
+
+def _relax(dist, label, candidate, candidate_label):
+    better = candidate < dist - EPSILON
+    np.copyto(dist, candidate, where=better)
+    np.copyto(label, candidate_label, where=better)
+    return better.any()
+
+
+def _scan_row(dist, label, steps):
+    """Propagate along a row in place: dist[x] = min(dist[k] + steps[k+1..x]).
+
+    steps[x] is the cost of moving from x - 1 to x. The running minimum of
+    dist - prefix(steps) gives the whole left-to-right pass in one
+    accumulate; the owner comes from the last index that set the minimum.
+    """
+    prefix = np.cumsum(steps)
+    shifted = dist - prefix
+    running = np.minimum.accumulate(shifted)
+    source = np.maximum.accumulate(np.where(shifted <= running, np.arange(len(dist)), 0))
+    return _relax(dist, label, running + prefix, label[source])
+
+
+def sweep_distance(cost, seeds, max_sweeps=None):
+    """Multi-source shortest travel cost over an 8-connected cost grid.
+
+    cost is a (width, height) grid and seeds a matching int grid holding a
+    source index on source cells and -1 elsewhere. Moves cost the mean of
+    the two cells' costs, times sqrt(2) on diagonals, as in roads.RoadPlanner.
+    Returns (dist, label): the cost to the nearest source and its index.
+
+    Each sweep walks the rows down and back up; a row first takes the
+    best of its three neighbours in the previous row, then is propagated
+    both ways along itself with prefix sums, so every row is a handful of
+    whole-row array operations. Sweeps repeat until nothing improves,
+    which gives exact distances (uniform costs converge in one sweep;
+    winding low-cost corridors take one more per turn back). Every sweep
+    relaxes every move, so width * height sweeps always suffice; reaching
+    max_sweeps (that bound by default) without converging raises
+    RuntimeError rather than returning overestimates.
+    """
+    cost = np.ascontiguousarray(cost.T, dtype=np.float64)  # Rows are y
+    label = np.ascontiguousarray(seeds.T, dtype=np.int64)
+    dist = np.where(label >= 0, 0.0, np.inf)
+    height, width = cost.shape
+    # Horizontal step costs within each row, forwards and reversed
+    forward = np.zeros_like(cost)
+    forward[:, 1:] = (cost[:, 1:] + cost[:, :-1]) * 0.5
+    backward = np.zeros_like(cost)
+    backward[:, 1:] = forward[:, :0:-1]
+
+    def from_row(y, p):
+        # Straight and diagonal moves from row p into row y
+        changed = _relax(dist[y], label[y], dist[p] + (cost[p] + cost[y]) * 0.5, label[p])
+        if width > 1:
+            diagonal = SQRT2 * 0.5
+            changed |= _relax(dist[y, 1:], label[y, 1:],
+                              dist[p, :-1] + (cost[p, :-1] + cost[y, 1:]) * diagonal, label[p, :-1])
+            changed |= _relax(dist[y, :-1], label[y, :-1],
+                              dist[p, 1:] + (cost[p, 1:] + cost[y, :-1]) * diagonal, label[p, 1:])
+        return changed
+
+    def along_row(y):
+        changed = _scan_row(dist[y], label[y], forward[y])
+        return _scan_row(dist[y, ::-1], label[y, ::-1], backward[y]) | changed
+
+    limit = max_sweeps or width * height
+    for _ in range(limit):
+        changed = False
+        for y in range(height):
+            if y:
+                changed |= from_row(y, y - 1)
+            changed |= along_row(y)
+        for y in range(height - 2, -1, -1):
+            changed |= from_row(y, y + 1)
+            changed |= along_row(y)
+        if not changed:
+            break
+    else:
+        raise RuntimeError(f'distances did not converge in {limit} sweeps')
+    return dist.T, label.T
+
+
+def _quantize(dist):
+    # Finite distances saturate one below MAX_DISTANCE, which only inf may take
+    scaled = np.minimum(np.round(np.where(np.isfinite(dist), dist, 0) * DISTANCE_SCALE), MAX_DISTANCE - 1)
+    return np.where(np.isfinite(dist), scaled, MAX_DISTANCE).astype(np.uint16)
+
+
+def distance_fields(world):
+    """Territory and nearest-feature grids of a planned world.
+
+    territory holds, for every cell, the index (in world['settlements']
+    order, as in the .mwld settlements table) of the settlement that can
+    reach it most cheaply over the road-aware movement costs, and
+    territory_cost that travel cost. Each dist_* grid is the octile
+    distance in tiles to the nearest settlement, settlement of one class
+    or resource deposit of one type. Distances are uint16 in
+    1 / DISTANCE_SCALE tiles, NO_OWNER and MAX_DISTANCE marking nothing;
+    farther reachable cells saturate at MAX_DISTANCE - 1.
+    """
+    shape = world['elevation'].shape
+    points = list(world['settlements'].items())
+    seeds = np.full(shape, -1, dtype=np.int64)
+    for i, (pos, _) in enumerate(points):
+        seeds[pos] = i
+    cost, owner = sweep_distance(movement_cost(world['elevation'], world['roads']), seeds)
+    fields = {
+        'territory': np.where(owner >= 0, owner, NO_OWNER).astype(np.uint16),
+        'territory_cost': _quantize(cost)
+    }
+
+    uniform = np.ones(shape)
+    targets = {'settlement': seeds >= 0}
+    for settlement_type in SETTLEMENT_TYPES:
+        mask = np.zeros(shape, dtype=bool)
+        for pos, kind in points:
+            mask[pos] = kind == settlement_type
+        targets[settlement_type] = mask
+    for resource_type in RESOURCE_TYPES:
+        targets[resource_type] = world['layers']['resources'][resource_type]
+    for name, mask in targets.items():
+        dist, _ = sweep_distance(uniform, np.where(mask, 0, -1))
+        fields[f'dist_{name}'] = _quantize(dist)
+    return fields
@@ -0,0 +1,172 @@
+import heapq
+
+import numpy as np
+
+from classify import WATER_LEVEL
+
+# D8 neighbour offsets (dx, dy) and their step lengths
+D8 = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)]
+D8_DISTANCE = np.array([1.0, 1.0, 1.0, 1.0, 2 ** 0.5, 2 ** 0.5, 2 ** 0.5, 2 ** 0.5])
+
+
+def fill_depressions(elevation, epsilon=1e-6):
+    """Priority-flood the elevation so every land cell drains to the sea.
+
+    Water cells and the map border are the outlets. Land is raised just
+    enough (by epsilon per step) that each cell has a strictly lower
+    neighbour, so flow can never stall in a pit. Every cell is pushed and
+    popped once: O(n log n) regardless of the terrain.
+    """
+    width, height = elevation.shape
+    stride = height + 2
+    water = elevation < WATER_LEVEL
+
+    closed = np.ones((width + 2, height + 2), dtype=bool)
+    closed[1:-1, 1:-1] = water
+    filled = np.zeros((width + 2, height + 2))
+    filled[1:-1, 1:-1] = elevation
+
+    # Seeds: land on the map edge and land touching water
+    seeds = np.zeros_like(water)
+    seeds[[0, -1], :] = True
+    seeds[:, [0, -1]] = True
+    seeds[:-1, :] |= water[1:, :]
+    seeds[1:, :] |= water[:-1, :]
+    seeds[:, :-1] |= water[:, 1:]
+    seeds[:, 1:] |= water[:, :-1]
+    seeds &= ~water
+    sx, sy = np.nonzero(seeds)
+    seed_index = (sx + 1) * stride + sy + 1
+
+    closed = closed.ravel().tolist()
+    level = filled.ravel().tolist()
+    for i in seed_index.tolist():
+        closed[i] = True
+    heap = list(zip([level[i] for i in seed_index.tolist()], seed_index.tolist()))
+    heapq.heapify(heap)
+
+    offsets = [dx * stride + dy for dx, dy in D8]
+    while heap:
+        z, i = heapq.heappop(heap)
+        for offset in offsets:
+            j = i + offset
+            if closed[j]:
+                continue
+            closed[j] = True
+            if level[j] <= z:
+                level[j] = z + epsilon
+            heapq.heappush(heap, (level[j], j))
+
+    return np.array(level).reshape(width + 2, height + 2)[1:-1, 1:-1]
+
+
+def flow_directions(filled, water):
+    """D8 steepest-descent direction for every cell, as an index into D8.
+
+    Water cells are sinks (-1). Land on the map edge may drain off the map,
+    which is reported as -2.
+    """
+    width, height = filled.shape
+    padded = np.full((width + 2, height + 2), -np.inf)
+    padded[1:-1, 1:-1] = filled
+
+    drops = np.empty((len(D8), width, height))
+    for k, (dx, dy) in enumerate(D8):
+        neighbour = padded[1 + dx:width + 1 + dx, 1 + dy:height + 1 + dy]
+        drops[k] = (filled - neighbour) / D8_DISTANCE[k]
+
+    direction = np.argmax(drops, axis=0).astype(np.int8)
+    off_map = np.isinf(drops.max(axis=0))
+    direction[off_map] = -2
+    direction[water] = -1
+    return direction
+
+
+def flow_accumulation(filled, direction):
+    """Number of cells draining through each cell, counting itself.
+
+    Cells are visited from highest to lowest filled elevation, which is a
+    valid upstream-first order because every land cell flows strictly down.
+    """
+    width, height = filled.shape
+    land = direction >= 0
+    dx = np.array([d[0] for d in D8])
+    dy = np.array([d[1] for d in D8])
+
+    xs, ys = np.nonzero(land)
+    codes = direction[xs, ys]
+    receiver = np.full(filled.shape, -1, dtype=np.int64)
+    receiver[xs, ys] = (xs + dx[codes]) * height + ys + dy[codes]
+
+    accumulation = (direction != -1).astype(np.float64).ravel()
+    flat_receiver = receiver.ravel()
+    order = np.argsort(-filled.ravel(), kind='stable')
+    order = order[land.ravel()[order]]
+
+    acc = accumulation.tolist()
+    rec = flat_receiver.tolist()
+    for i in order.tolist():
+        acc[rec[i]] += acc[i]
+    return np.array(acc).reshape(width, height), receiver
+
+
+def extract_rivers(accumulation, direction, receiver, water, num_rivers=10, min_accumulation=20):
+    """Turn the accumulation grid into a river mask and per-cell widths.
+
+    The threshold is chosen so roughly num_rivers rivers reach the sea or
+    map edge; tributaries that pass the same threshold join them. Width is
+    1, 2 or 3 depending on how much more than the threshold a cell carries.
+    """
+    land = direction != -1
+    flat_receiver = receiver.ravel()
+    drains_out = direction == -2
+    drains_to_water = np.zeros_like(land)
+    into = flat_receiver >= 0
+    drains_to_water.ravel()[into] = water.ravel()[flat_receiver[into]]
+    mouths = land & (drains_out | drains_to_water)
+
+    outflow = np.sort(accumulation[mouths])[::-1]
+    if num_rivers <= 0 or not len(outflow):
+        return np.zeros(land.shape, dtype=bool), np.zeros(land.shape, dtype=np.uint8)
+    threshold = max(outflow[min(num_rivers, len(outflow)) - 1], min_accumulation)
+
+    rivers = land & (accumulation >= threshold)
+    widths = rivers.astype(np.uint8)
+    widths += rivers & (accumulation >= threshold * 4)
+    widths += rivers & (accumulation >= threshold * 16)
+    return rivers, widths
+
+
+def river_footprint(widths):
+    """Cells covered by river water: wide rivers spill into their neighbours."""
+    footprint = widths > 0
+    wide = widths >= 2
+    wider = widths >= 3
+    out = footprint.copy()
+    out[:-1, :] |= wide[1:, :]
+    out[1:, :] |= wide[:-1, :]
+    out[:, :-1] |= wide[:, 1:]
+    out[:, 1:] |= wide[:, :-1]
+    out[:-1, :-1] |= wider[1:, 1:]
+    out[1:, 1:] |= wider[:-1, :-1]
+    out[:-1, 1:] |= wider[1:, :-1]
+    out[1:, :-1] |= wider[:-1, 1:]
+    return out
+
+
+def generate_hydrology(elevation, num_rivers=10, min_accumulation=20):
+    """Fill, route and accumulate flow over the whole elevation array."""
+    water = elevation < WATER_LEVEL
+    filled = fill_depressions(elevation)
+    direction = flow_directions(filled, water)
+    accumulation, receiver = flow_accumulation(filled, direction)
+    rivers, widths = extract_rivers(
+        accumulation, direction, receiver, water, num_rivers, min_accumulation
+    )
+    return {
+        'filled': filled,
+        'direction': direction,
+        'accumulation': accumulation,
+        'rivers': rivers,
+        'widths': widths
+    }
@@ -0,0 +1,320 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from classify import TERRAIN_IDS, SETTLEMENT_TYPES, RESOURCE_TYPES
+from pngstream import PNGStreamWriter
+from roads import RoadPlanner, movement_cost
+from worldfile import write_world_file
+
+SEGMENT_CELLS = 16  # Road paths are marked dirty in pieces of this many cells
+
+
+class WorldEditor:
+    """In-place edits of a planned world with incremental re-rendering.
+
+    The rendered map lives in canvas_filename as a memory-mapped RGBA .npy
+    array. A sidecar canvas_filename + '.json' records which world it was
+    rendered from (seed, tileset and stage keys); when it is missing, does
+    not match, or the canvas has been edited since, the canvas is
+    re-rendered in full bands, so pixels of another world are never reused.
+    Every edit updates the world layers and records the tile rectangles it
+    touched; apply() recomposites only those rectangles into the canvas.
+    Roads are re-routed one link at a time, and only the links whose path
+    crosses an edited area or ends at a moved settlement.
+    """
+
+    def __init__(self, generator, world=None, canvas_filename='world_map.npy', band_rows=64):
+        self.generator = generator
+        self.world = world if world is not None else generator.plan_world()
+        self.width, self.height = generator.output_size
+        self.dirty = []
+        # Whether layers changed since planning, making derived data stale
+        self.edited = False
+
+        # Links are (a, b, path) with settlement positions for a and b
+        self.links = [(a, b, list(path)) for a, b, path in self.world.get('road_links', [])]
+        # How many links (and settlements) hold each road cell, so a removed
+        # path only clears cells no other road still uses
+        self.road_use = np.zeros(generator.output_size, dtype=np.uint16)
+        for _, _, path in self.links:
+            for pos in path:
+                self.road_use[pos] += 1
+        for pos in self.world['settlements']:
+            self.road_use[pos] += 1
+        self.planner = RoadPlanner(movement_cost(self.world['elevation']))
+
+        tile_size = generator.tile_size
+        shape = (self.height * tile_size, self.width * tile_size, 4)
+        self.identity_filename = canvas_filename + '.json'
+        identity = self._identity()
+        if identity is not None and os.path.exists(canvas_filename) and self._stored_identity() == identity:
+            self.canvas = np.lib.format.open_memmap(canvas_filename, mode='r+')
+        else:
+            self._store_identity(None)
+            self.canvas = np.lib.format.open_memmap(canvas_filename, mode='w+', dtype=np.uint8, shape=shape)
+            for y0 in range(0, self.height, band_rows):
+                y1 = min(y0 + band_rows, self.height)
+                self.canvas[y0 * tile_size:y1 * tile_size] = generator.composite_world(self.world, (y0, y1))
+            self.canvas.flush()
+            self._store_identity(identity)
+
+    def _identity(self):
+        # Worlds that were edited (no stage keys) cannot be recognised again
+        stages = self.world.get('stages')
+        if not stages:
+            return None
+        blob = json.dumps({
+            'seed': self.generator.seed,
+            'size': [self.width, self.height],
+            'tile_size': self.generator.tile_size,
+            'tileset': self.generator.atlas.digest,
+            'stages': {name: stages[name] for name in ('classification', 'hydrology', 'settlements', 'roads')}
+        }, sort_keys=True)
+        return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+    def _stored_identity(self):
+        try:
+            with open(self.identity_filename) as f:
+                return json.load(f).get('world')
+        except (OSError, ValueError):
+            return None
+
+    def _store_identity(self, identity):
+        with open(self.identity_filename, 'w') as f:
+            json.dump({'world': identity}, f)
+
+    def _rect(self, x0, y0, x1, y1, halo=0):
+        # Clip a half-open tile rectangle (plus halo) to the map
+        return (max(0, min(x0, x1) - halo), max(0, min(y0, y1) - halo),
+                min(self.width, max(x0, x1) + halo), min(self.height, max(y0, y1) + halo))
+
+    def _mark(self, rect):
+        x0, y0, x1, y1 = rect
+        if x0 < x1 and y0 < y1:
+            self.dirty.append(rect)
+            # Cached stage results no longer describe this world
+            self.world.pop('stages', None)
+            self.edited = True
+
+    def _mark_path(self, path):
+        for i in range(0, len(path), SEGMENT_CELLS):
+            xs, ys = zip(*path[i:i + SEGMENT_CELLS + 1])
+            self._mark((min(xs), min(ys), max(xs) + 1, max(ys) + 1))
+
+    def _add_road(self, path):
+        roads = self.world['roads']
+        for pos in path:
+            self.road_use[pos] += 1
+            roads[pos] = True
+        self._mark_path(path)
+
+    def _remove_road(self, path):
+        roads = self.world['roads']
+        for pos in path:
+            self.road_use[pos] -= 1
+            if not self.road_use[pos]:
+                roads[pos] = False
+        self._mark_path(path)
+
+    def _route(self, a, b):
+        path = self.planner.find_path(a, b)
+        self._add_road(path)
+        self.links.append((a, b, path))
+
+    def _reroute(self, selected):
+        # Take every selected link off the map before routing any of them
+        keep, moved = [], []
+        for link in self.links:
+            (moved if selected(link) else keep).append(link)
+        self.links = keep
+        for _, _, path in moved:
+            self._remove_road(path)
+        for a, b, _ in moved:
+            self._route(a, b)
+        return len(moved)
+
+    def paint_terrain(self, x0, y0, x1, y1, terrain):
+        """Set the biome of every cell in [x0, x1) x [y0, y1)."""
+        rect = self._rect(x0, y0, x1, y1)
+        self.world['layers']['terrain'][rect[0]:rect[2], rect[1]:rect[3]] = TERRAIN_IDS[terrain]
+        self._mark(rect)
+
+    def set_resource(self, x0, y0, x1, y1, resource=None):
+        """Place one resource type on the rectangle, or clear resources with None."""
+        if resource is not None and resource not in RESOURCE_TYPES:
+            raise ValueError(f'unknown resource {resource!r}')
+        rect = self._rect(x0, y0, x1, y1)
+        window = (slice(rect[0], rect[2]), slice(rect[1], rect[3]))
+        for name, mask in self.world['layers']['resources'].items():
+            mask[window] = name == resource
+        self._mark(rect)
+
+    def set_elevation(self, x0, y0, x1, y1, value):
+        """Set the elevation of a rectangle and reclassify it.
+
+        Biomes, coasts, resources and settlement classes are recomputed from
+        the new heights (coasts one cell past the rectangle), and roads
+        crossing it are re-routed over the new costs. Rivers are not
+        re-traced; run the hydrology stage again for that.
+        """
+        rect = self._rect(x0, y0, x1, y1)
+        elevation = self.world['elevation']
+        elevation[rect[0]:rect[2], rect[1]:rect[3]] = value
+
+        # Coasts one cell out can change, and they need their own neighbours
+        cx0, cy0, cx1, cy1 = self._rect(*rect, halo=1)
+        wx0, wy0, wx1, wy1 = self._rect(*rect, halo=2)
+        layers = self.generator.classify_world(
+            elevation[wx0:wx1, wy0:wy1], self.world['temperature'][wx0:wx1, wy0:wy1], (wx0, wy0)
+        )
+        inner = (slice(cx0 - wx0, cx1 - wx0), slice(cy0 - wy0, cy1 - wy0))
+        target = (slice(cx0, cx1), slice(cy0, cy1))
+        for name, grid in layers.items():
+            if name == 'resources':
+                for resource, mask in grid.items():
+                    self.world['layers']['resources'][resource][target] = mask[inner]
+            else:
+                self.world['layers'][name][target] = grid[inner]
+        self._mark((cx0, cy0, cx1, cy1))
+
+        cost = movement_cost(elevation[rect[0]:rect[2], rect[1]:rect[3]])
+        for x in range(rect[0], rect[2]):
+            for y in range(rect[1], rect[3]):
+                self.planner.cost[self.planner.index((x, y))] = float(cost[x - rect[0], y - rect[1]])
+        # A lower floor keeps the A* heuristic admissible
+        self.planner.min_cost = min(self.planner.min_cost, float(cost.min()))
+
+        def crosses(link):
+            return any(rect[0] <= x < rect[2] and rect[1] <= y < rect[3] for x, y in link[2])
+        return self._reroute(crosses)
+
+    def add_settlement(self, x, y, settlement_type=None):
+        """Found a settlement and connect it by road to its nearest neighbour.
+
+        Spacing rules are not enforced for hand-placed settlements; the type
+        defaults to the class computed for the cell.
+        """
+        if settlement_type is None:
+            settlement_type = SETTLEMENT_TYPES[self.world['layers']['settlement_type'][x, y]]
+        index = self.world['settlement_index']
+        nearest = index.nearest(x, y)
+        index.insert(x, y, settlement_type)
+        self.world['settlements'][(x, y)] = settlement_type
+        self._add_road([(x, y)])
+        if nearest is not None:
+            self._route(nearest[0], (x, y))
+
+    def remove_settlement(self, x, y):
+        """Remove a settlement and its roads, chaining its neighbours back together."""
+        pos = (x, y)
+        self.world['settlement_index'].remove(x, y)
+        del self.world['settlements'][pos]
+        self._remove_road([pos])
+
+        neighbours = []
+        keep = []
+        for link in self.links:
+            a, b, path = link
+            if pos not in (a, b):
+                keep.append(link)
+                continue
+            self._remove_road(path)
+            other = b if a == pos else a
+            if other not in neighbours:
+                neighbours.append(other)
+        self.links = keep
+        for a, b in zip(neighbours, neighbours[1:]):
+            self._route(a, b)
+
+    def move_settlement(self, old, new):
+        """Move a settlement and re-route the roads that end at it."""
+        index = self.world['settlement_index']
+        settlement_type = index.remove(*old)
+        index.insert(*new, settlement_type)
+        del self.world['settlements'][old]
+        self.world['settlements'][new] = settlement_type
+        self._remove_road([old])
+        self._add_road([new])
+
+        moved = [link for link in self.links if old in link[:2]]
+        self.links = [link for link in self.links if old not in link[:2]]
+        for _, _, path in moved:
+            self._remove_road(path)
+        for a, b, _ in moved:
+            self._route(new if a == old else a, new if b == old else b)
+
+    def dirty_rects(self):
+        """Pending dirty rectangles, with overlapping or touching ones merged."""
+        rects = list(self.dirty)
+        merged = True
+        while merged:
+            merged = False
+            out = []
+            for rect in rects:
+                for i, other in enumerate(out):
+                    if (rect[0] <= other[2] and other[0] <= rect[2]
+                            and rect[1] <= other[3] and other[1] <= rect[3]):
+                        out[i] = (min(rect[0], other[0]), min(rect[1], other[1]),
+                                  max(rect[2], other[2]), max(rect[3], other[3]))
+                        merged = True
+                        break
+                else:
+                    out.append(rect)
+            rects = out
+        return rects
+
+    def apply(self):
+        """Recomposite the dirty rectangles into the canvas; returns them."""
+        tile_size = self.generator.tile_size
+        rects = self.dirty_rects()
+        if rects:
+            # The canvas is about to hold edits no planned world reproduces
+            self._store_identity(None)
+        with self.generator.tracer.span('apply_edits', rects=len(rects)) as span:
+            for x0, y0, x1, y1 in rects:
+                self.canvas[y0 * tile_size:y1 * tile_size, x0 * tile_size:x1 * tile_size] = \
+                    self.generator.composite_world(self.world, (y0, y1), (x0, x1))
+                span.count('tiles', (x1 - x0) * (y1 - y0))
+            self.canvas.flush()
+        self.dirty = []
+        self.world['road_links'] = list(self.links)
+        return rects
+
+    def export_png(self, filename, band_rows=64):
+        # The PNG is re-encoded from the canvas; no tiles are recomposited
+        rows = band_rows * self.generator.tile_size
+        with PNGStreamWriter(filename, self.canvas.shape[1], self.canvas.shape[0]) as png:
+            for y0 in range(0, self.canvas.shape[0], rows):
+                png.write_rows(np.ascontiguousarray(self.canvas[y0:y0 + rows]))
+
+    def refresh_derived(self):
+        """Rebuild the distance fields, travel graph and viewsheds the world
+        was planned with from the edited layers.
+
+        Data the generator is not configured to build is dropped rather
+        than saved stale.
+        """
+        world = self.world
+        generator = self.generator
+        builders = {
+            'fields': (generator.distance_fields, lambda: generator.compute_fields(
+                world['elevation'], world['layers'], world['roads'], world['settlements'])),
+            'navigation': (generator.nav_cluster_size, lambda: generator.build_navigation(
+                world['elevation'], world['roads'], world['settlements'])),
+            'viewsheds': (generator.view_radius, lambda: generator.compute_viewsheds(
+                world['elevation'], world['settlements'])),
+        }
+        for name, (enabled, build) in builders.items():
+            if world.get(name) is not None:
+                world[name] = build() if enabled else None
+        self.edited = False
+
+    def save_data(self, filename):
+        # Derived sections are written too, rebuilt first if edits made them stale
+        if self.edited:
+            self.refresh_derived()
+        write_world_file(filename, self.world, self.width, self.height, self.generator.seed,
+                         self.generator.derived_sections(self.world))
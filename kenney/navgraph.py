@@ -0,0 +1,354 @@
+import heapq
+
+import numpy as np
+
+from roads import RoadPlanner, SQRT2, INF
+
+DEFAULT_CLUSTER_SIZE = 16
+DEFAULT_LANDMARKS = 8
+
+
+class NavGraph:
+    """Hierarchical (HPA*-style) navigation graph over a movement-cost grid.
+
+    The map is cut into cluster_size square clusters. Each shared cluster
+    border gets an entrance every cluster_size // 2 cells, at the cheapest
+    crossing in that span; entrance nodes are joined across the border by
+    one step and to every other node of their cluster by the precomputed
+    shortest in-cluster distance. Settlements are permanent nodes of their
+    cluster, and an all-pairs settlement distance / first-hop table is
+    kept. A long route is then an A* search over the abstract nodes plus
+    two small in-cluster searches, instead of a full grid search. The
+    search is guided by landmark (ALT) distances: exact graph distances
+    from a few far-apart nodes give a much tighter lower bound than the
+    straight-line distance.
+
+    The graph is stored as flat arrays (node positions and a CSR edge
+    list), which is also how it is exported to the world file.
+    """
+
+    def __init__(self, cost, cluster_size, nodes, offsets, targets, weights,
+                 settlement_nodes, settlement_dist, settlement_hop, landmarks=None):
+        self.cost = cost
+        self.width, self.height = cost.shape
+        self.cluster_size = cluster_size
+        self.nodes = nodes                  # (n, 2) node cell positions
+        self.offsets = offsets              # edges of node i: offsets[i]:offsets[i + 1]
+        self.targets = targets
+        self.weights = weights
+        self.settlement_nodes = settlement_nodes
+        self.settlement_dist = settlement_dist
+        self.settlement_hop = settlement_hop
+        self.landmarks = landmarks          # (k, n) distances from each landmark
+        self.min_cost = float(cost.min())
+        self.expanded = 0  # Abstract nodes popped by the last route query
+
+        self.positions = [tuple(p) for p in nodes.tolist()]
+        self.node_ids = {pos: i for i, pos in enumerate(self.positions)}
+        self.adjacency = [
+            list(zip(targets[offsets[i]:offsets[i + 1]].tolist(),
+                     weights[offsets[i]:offsets[i + 1]].tolist()))
+            for i in range(len(self.positions))
+        ]
+        # Nodes per cluster, for connecting query endpoints
+        self.cluster_nodes = {}
+        for i, pos in enumerate(self.positions):
+            self.cluster_nodes.setdefault(self.cluster_of(pos), []).append(i)
+
+    def cluster_of(self, pos):
+        return (pos[0] // self.cluster_size, pos[1] // self.cluster_size)
+
+    def cluster_bounds(self, cluster):
+        size = self.cluster_size
+        x0, y0 = cluster[0] * size, cluster[1] * size
+        return x0, y0, min(x0 + size, self.width), min(y0 + size, self.height)
+
+    def _local(self, cluster):
+        x0, y0, x1, y1 = self.cluster_bounds(cluster)
+        return RoadPlanner(self.cost[x0:x1, y0:y1]), (x0, y0)
+
+    def distances(self, source):
+        """Dijkstra over the abstract graph: (dist, first) dicts by node.
+
+        first[n] is the node after source on the cheapest way to n.
+        """
+        dist = {source: 0.0}
+        first = {source: source}
+        heap = [(0.0, source)]
+        adjacency = self.adjacency
+        while heap:
+            d, a = heapq.heappop(heap)
+            if d > dist[a]:
+                continue
+            for b, w in adjacency[a]:
+                nd = d + w
+                if nd < dist.get(b, INF):
+                    dist[b] = nd
+                    first[b] = b if a == source else first[a]
+                    heapq.heappush(heap, (nd, b))
+        return dist, first
+
+    def _landmark_table(self, count):
+        # Farthest-first landmarks: each one is the node farthest from those chosen
+        size = len(self.positions)
+        table = np.zeros((count, size), dtype=np.float32)
+        nearest = np.full(size, np.inf)
+        source = 0
+        for k in range(min(count, size)):
+            dist, _ = self.distances(source)
+            row = np.full(size, np.inf)
+            row[list(dist)] = list(dist.values())
+            table[k] = np.where(np.isinf(row), 0, row)
+            nearest = np.minimum(nearest, np.where(np.isinf(row), 0, row))
+            source = int(np.argmax(nearest))
+        return table[:min(count, size)]
+
+    @classmethod
+    def build(cls, cost, settlements=(), cluster_size=DEFAULT_CLUSTER_SIZE, landmarks=DEFAULT_LANDMARKS):
+        """Build the graph for a (width, height) cost grid and settlement positions."""
+        width, height = cost.shape
+        span = max(1, cluster_size // 2)
+        node_ids = {}
+        positions = []
+        edges = {}
+
+        def node(pos):
+            if pos not in node_ids:
+                node_ids[pos] = len(positions)
+                positions.append(pos)
+            return node_ids[pos]
+
+        def link(a, b, weight):
+            if weight < edges.get((a, b), INF):
+                edges[(a, b)] = edges[(b, a)] = weight
+
+        # Entrances: the cheapest crossing of every span of every cluster border
+        for axis in (0, 1):
+            length = height if axis == 0 else width
+            for border in range(cluster_size, (width if axis == 0 else height), cluster_size):
+                if axis == 0:
+                    crossing = cost[border - 1] + cost[border]
+                else:
+                    crossing = cost[:, border - 1] + cost[:, border]
+                for c0 in range(0, length, cluster_size):
+                    for s0 in range(c0, min(c0 + cluster_size, length), span):
+                        s1 = min(s0 + span, c0 + cluster_size, length)
+                        k = s0 + int(np.argmin(crossing[s0:s1]))
+                        if axis == 0:
+                            a, b = (border - 1, k), (border, k)
+                        else:
+                            a, b = (k, border - 1), (k, border)
+                        link(node(a), node(b), float(crossing[k]) * 0.5)
+        settlement_nodes = [node(tuple(pos)) for pos in settlements]
+
+        # Intra-cluster distances between every pair of nodes in a cluster
+        clusters = {}
+        for i, (x, y) in enumerate(positions):
+            clusters.setdefault((x // cluster_size, y // cluster_size), []).append(i)
+        for (cx, cy), members in clusters.items():
+            x0, y0 = cx * cluster_size, cy * cluster_size
+            planner = RoadPlanner(cost[x0:x0 + cluster_size, y0:y0 + cluster_size])
+            for n, a in enumerate(members[:-1]):
+                ax, ay = positions[a]
+                dist, _, _ = planner.nearest_sources([(ax - x0, ay - y0)])
+                for b in members[n + 1:]:
+                    bx, by = positions[b]
+                    d = dist[planner.index((bx - x0, by - y0))]
+                    if d < INF:
+                        link(a, b, d)
+
+        # CSR edge arrays, sorted by source node
+        pairs = sorted(edges)
+        sources = np.array([a for a, _ in pairs], dtype=np.int64)
+        targets = np.array([b for _, b in pairs], dtype=np.uint32)
+        weights = np.array([edges[p] for p in pairs], dtype=np.float32)
+        offsets = np.zeros(len(positions) + 1, dtype=np.uint32)
+        np.cumsum(np.bincount(sources, minlength=len(positions)), out=offsets[1:])
+
+        graph = cls(
+            cost.astype(np.float32), cluster_size, np.array(positions, dtype=np.uint32).reshape(-1, 2),
+            offsets, targets, weights, np.array(settlement_nodes, dtype=np.uint32),
+            None, None
+        )
+        graph.settlement_dist, graph.settlement_hop = graph._settlement_table()
+        graph.landmarks = graph._landmark_table(landmarks)
+        return graph
+
+    def _settlement_table(self):
+        # One Dijkstra over the abstract graph per settlement; hop is the
+        # first node after the source on the way to each other settlement
+        count = len(self.settlement_nodes)
+        table = np.full((count, count), np.inf, dtype=np.float32)
+        hops = np.full((count, count), -1, dtype=np.int32)
+        for i, source in enumerate(self.settlement_nodes.tolist()):
+            dist, first = self.distances(source)
+            for j, target in enumerate(self.settlement_nodes.tolist()):
+                if target in dist:
+                    table[i, j] = dist[target]
+                    hops[i, j] = first[target]
+        return table, hops
+
+    def sections(self):
+        """The graph as 2D arrays for write_world_file's extra_sections."""
+        return {
+            'nav_meta': np.array([[self.cluster_size]], dtype='<u4'),
+            'nav_cost': np.ascontiguousarray(self.cost.T, dtype='<f4'),
+            'nav_nodes': self.nodes.astype('<u4'),
+            'nav_offsets': self.offsets.astype('<u4').reshape(1, -1),
+            'nav_targets': self.targets.astype('<u4').reshape(1, -1),
+            'nav_weights': self.weights.astype('<f4').reshape(1, -1),
+            'nav_settle_node': self.settlement_nodes.astype('<u4').reshape(1, -1),
+            'nav_settle_dist': self.settlement_dist.astype('<f4'),
+            'nav_settle_hop': self.settlement_hop.astype('<i4'),
+            'nav_landmarks': self.landmarks.astype('<f4'),
+        }
+
+    @classmethod
+    def from_world_file(cls, world_file):
+        """Load the graph exported into a WorldFile (see sections)."""
+        s = world_file.sections
+        if 'nav_meta' not in s:
+            raise ValueError('world file has no navigation graph')
+        return cls(
+            np.asarray(s['nav_cost']).T, int(s['nav_meta'][0, 0]), np.asarray(s['nav_nodes']),
+            s['nav_offsets'][0], s['nav_targets'][0], s['nav_weights'][0],
+            s['nav_settle_node'][0], np.asarray(s['nav_settle_dist']), np.asarray(s['nav_settle_hop']),
+            np.asarray(s['nav_landmarks'])
+        )
+
+    def _endpoint_costs(self, pos):
+        # In-cluster distances from pos to each node of its cluster
+        cluster = self.cluster_of(pos)
+        planner, (x0, y0) = self._local(cluster)
+        dist, _, _ = planner.nearest_sources([(pos[0] - x0, pos[1] - y0)])
+        costs = {}
+        for i in self.cluster_nodes.get(cluster, ()):
+            x, y = self.positions[i]
+            d = dist[planner.index((x - x0, y - y0))]
+            if d < INF:
+                costs[i] = d
+        return costs, dist, planner
+
+    def route(self, start, goal, refine=False):
+        """Cheapest route from start to goal as (cost, positions).
+
+        positions are the abstract waypoints (start, graph nodes, goal), or
+        every cell of the route with refine=True. Returns (inf, []) when
+        goal cannot be reached.
+
+        Endpoints within cluster_size of each other are searched exactly,
+        on the grid around them, and that route (always cell by cell) is
+        kept unless the graph finds a cheaper one. Longer routes must pass
+        through entrances and are not optimal: on 150x120 maps with 16-cell
+        clusters they cost on average 6% more than the true shortest route,
+        12% at the 90th percentile and up to about 1.3 times as much.
+        """
+        start, goal = tuple(start), tuple(goal)
+        if start == goal:
+            return 0.0, [start]
+        start_costs, _, _ = self._endpoint_costs(start)
+        goal_costs, _, _ = self._endpoint_costs(goal)
+        begin, end = -1, -2
+
+        # Nearby endpoints: an exact search of the window around both. The
+        # abstract graph is worst here, where a short route crosses a
+        # border far from its entrances
+        best, direct = INF, None
+        if max(abs(start[0] - goal[0]), abs(start[1] - goal[1])) <= self.cluster_size:
+            pad = self.cluster_size
+            x0, y0 = max(0, min(start[0], goal[0]) - pad), max(0, min(start[1], goal[1]) - pad)
+            x1 = min(self.width, max(start[0], goal[0]) + pad + 1)
+            y1 = min(self.height, max(start[1], goal[1]) + pad + 1)
+            planner = RoadPlanner(self.cost[x0:x1, y0:y1])
+            window, parent, _ = planner.nearest_sources([(start[0] - x0, start[1] - y0)])
+            i = planner.index((goal[0] - x0, goal[1] - y0))
+            if window[i] < INF:
+                best = window[i]
+                direct = [(x + x0, y + y0) for x, y in reversed(planner.trace(parent, i))]
+
+        # Lower bound on the cost to the goal for every node at once: the
+        # better of the octile distance and the landmark triangle bounds
+        positions = self.positions
+        nodes = self.nodes.astype(np.float64)
+        dx = np.abs(nodes[:, 0] - goal[0])
+        dy = np.abs(nodes[:, 1] - goal[1])
+        bound = self.min_cost * (dx + dy) + (SQRT2 - 2) * self.min_cost * np.minimum(dx, dy)
+        if self.landmarks is not None and len(self.landmarks) and goal_costs:
+            ids = list(goal_costs)
+            through = self.landmarks[:, ids] + np.array([goal_costs[i] for i in ids])
+            to_goal = through.min(axis=1)
+            bound = np.maximum(bound, np.abs(self.landmarks - to_goal[:, None]).max(axis=0))
+        heuristic = bound.tolist().__getitem__
+
+        dist = {}
+        parent = {}
+        frontier = []
+        for i, d in start_costs.items():
+            dist[i] = d
+            parent[i] = begin
+            frontier.append((d + heuristic(i), i))
+        heapq.heapify(frontier)
+        finish = begin if direct else None
+        expanded = 0
+        while frontier:
+            f, a = heapq.heappop(frontier)
+            if f >= best:
+                break
+            d = dist[a]
+            if f > d + heuristic(a):
+                continue
+            expanded += 1
+            if a in goal_costs and d + goal_costs[a] < best:
+                best = d + goal_costs[a]
+                finish = a
+            for b, w in self.adjacency[a]:
+                nd = d + w
+                if nd < dist.get(b, INF):
+                    dist[b] = nd
+                    parent[b] = a
+                    heapq.heappush(frontier, (nd + heuristic(b), b))
+        self.expanded = expanded
+
+        if finish is None:
+            return INF, []
+        if finish == begin:
+            return best, direct
+        waypoints = [goal]
+        i = finish
+        while i != begin:
+            waypoints.append(positions[i])
+            i = parent[i]
+        waypoints.append(start)
+        waypoints.reverse()
+        if refine:
+            waypoints = self.refine(waypoints)
+        return best, waypoints
+
+    def refine(self, waypoints):
+        """Expand abstract waypoints into a cell-by-cell path."""
+        path = [waypoints[0]]
+        for a, b in zip(waypoints, waypoints[1:]):
+            if a == b:
+                continue
+            if self.cluster_of(a) != self.cluster_of(b):
+                path.append(b)  # Border crossing: the two cells are adjacent
+                continue
+            planner, (x0, y0) = self._local(self.cluster_of(a))
+            local = planner.find_path((a[0] - x0, a[1] - y0), (b[0] - x0, b[1] - y0))
+            path.extend((x + x0, y + y0) for x, y in local[1:])
+        return path
+
+    def settlement_distance(self, a, b):
+        """Table lookup of the travel cost between settlements a and b (indices)."""
+        return float(self.settlement_dist[a, b])
+
+    def next_hop(self, a, b):
+        """Position of the first graph node on the way from settlement a to b."""
+        hop = int(self.settlement_hop[a, b])
+        return self.positions[hop] if hop >= 0 else None
+
+    def settlement_route(self, a, b, refine=False):
+        # Both endpoints are graph nodes, so this is a pure abstract search
+        start = self.positions[int(self.settlement_nodes[a])]
+        goal = self.positions[int(self.settlement_nodes[b])]
+        return self.route(start, goal, refine)
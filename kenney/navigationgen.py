@@ -1,8 +1,14 @@
 from PIL import Image, ImageDraw
 import os
+from spriteatlas import write_sprite_atlas
 
-def create_navigation_sprites(output_dir="Navigation", size=16):
-    """Generate navigation-related sprites."""
+def create_navigation_sprites(output_dir="Navigation", size=16, atlas=False):
+    """Generate navigation-related sprites.
+
+    With atlas=True the sprites are packed into power-of-two sheets with a
+    nav_sprites.json manifest of source rectangles, instead of one PNG each.
+    Returns the paths of the files written.
+    """
     
     # Get absolute path and create Navigation directory
     abs_output_dir = os.path.abspath(output_dir)
@@ -96,12 +102,22 @@ def create_navigation_sprites(output_dir="Navigation", size=16):
     }
 
 
+    if atlas:
+        return write_sprite_atlas(
+            {filename[:-len('.png')]: sprite for filename, sprite in sprites.items()},
+            abs_output_dir, 'nav_sprites'
+        )
+
     # Save all sprites
+    written = []
     for filename, sprite in sprites.items():
         full_path = os.path.join(abs_output_dir, filename)
         sprite.save(full_path)
+        written.append(full_path)
         print(f"Saved: {filename}")
+    return written
 
 if __name__ == "__main__":
-    create_navigation_sprites()
+    import sys
+    create_navigation_sprites(atlas='--atlas' in sys.argv)
     print("Navigation sprites generated successfully!")
\ No newline at end of file
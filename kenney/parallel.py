@@ -0,0 +1,225 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from classify import RESOURCE_TYPES
+
+# Per-cell arrays shared between the main process and the workers
+LAYER_SPECS = {
+    'elevation': np.float64,
+    'temperature': np.float64,
+    'terrain': np.uint8,
+    'settlement_type': np.uint8,
+    'coast': np.bool_,
+    'buildable': np.bool_,
+    'metal': np.bool_,
+    'gems': np.bool_,
+    'wood': np.bool_,
+    'rivers': np.bool_,
+    'river_widths': np.uint8,
+    'roads': np.bool_,
+}
+CLASSIFIED = ['terrain', 'settlement_type', 'coast', 'buildable']
+
+
+class SharedArrays:
+    """Named NumPy arrays living in POSIX shared memory.
+
+    The creating process owns the blocks; workers attach to them by name
+    with SharedArrays.attach(description) and never copy the data.
+    """
+
+    def __init__(self, specs=None, description=None):
+        self.blocks = {}
+        self.arrays = {}
+        if description is not None:
+            for name, (block_name, shape, dtype) in description.items():
+                block = shared_memory.SharedMemory(name=block_name)
+                self._add(name, block, shape, dtype)
+            self.owner = False
+        else:
+            for name, (shape, dtype) in (specs or {}).items():
+                nbytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+                block = shared_memory.SharedMemory(create=True, size=nbytes)
+                self._add(name, block, shape, dtype)
+            self.owner = True
+
+    @classmethod
+    def attach(cls, description):
+        return cls(description=description)
+
+    def _add(self, name, block, shape, dtype):
+        self.blocks[name] = block
+        self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def describe(self):
+        return {
+            name: (self.blocks[name].name, array.shape, array.dtype.str)
+            for name, array in self.arrays.items()
+        }
+
+    def close(self):
+        self.arrays.clear()
+        for block in self.blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+        self.blocks.clear()
+
+
+# Worker-side state, set up once per process by _init_worker
+_worker = {}
+
+
+def _init_worker(generator, description):
+    _worker['generator'] = generator
+    _worker['shared'] = SharedArrays.attach(description)
+    _worker['buffers'] = {}
+
+
+def _shared_world(shared, settlements):
+    # Rebuild the plan_world dict on top of the shared arrays
+    layers = {name: shared[name] for name in CLASSIFIED}
+    layers['resources'] = {name: shared[name] for name in RESOURCE_TYPES}
+    return {
+        'elevation': shared['elevation'],
+        'temperature': shared['temperature'],
+        'layers': layers,
+        'rivers': shared['rivers'],
+        'river_widths': shared['river_widths'],
+        'roads': shared['roads'],
+        'settlements': settlements
+    }
+
+
+def _layers_task(rows):
+    generator = _worker['generator']
+    shared = _worker['shared']
+    width = generator.output_size[0]
+    y0, y1 = rows
+    elevation, temperature, layers = generator.generate_layers((0, y0, width, y1))
+    shared['elevation'][:, y0:y1] = elevation
+    shared['temperature'][:, y0:y1] = temperature
+    for name in CLASSIFIED:
+        shared[name][:, y0:y1] = layers[name]
+    for name in RESOURCE_TYPES:
+        shared[name][:, y0:y1] = layers['resources'][name]
+    return rows
+
+
+def _composite_task(rows, settlements, target, offset):
+    # Render a band of tile rows straight into a shared output buffer
+    generator = _worker['generator']
+    world = _shared_world(_worker['shared'], settlements)
+    if target[0] not in _worker['buffers']:
+        for buffer in _worker['buffers'].values():
+            buffer.close()
+        _worker['buffers'] = {target[0]: SharedArrays.attach({'image': target})}
+    image = _worker['buffers'][target[0]]['image']
+    band = generator.composite_world(world, rows)
+    image[offset:offset + band.shape[0]] = band
+    return rows
+
+
+def split_rows(height, parts, minimum=1):
+    """Split range(height) into at most parts contiguous (start, end) bands."""
+    size = max(minimum, -(-height // max(1, parts)))
+    return [(y, min(y + size, height)) for y in range(0, height, size)]
+
+
+class ParallelSession:
+    """A process pool plus the shared per-cell arrays of one world build.
+
+    Noise, classification and compositing are split into bands of rows
+    and run on the pool; global stages (hydrology, settlements, roads)
+    stay in the main process. Every random choice is hashed from absolute
+    cell coordinates, so the output is byte-identical for any worker count.
+    """
+
+    def __init__(self, generator, workers):
+        self.generator = generator
+        self.workers = workers
+        width, height = generator.output_size
+        self.shared = SharedArrays({
+            name: ((width, height), dtype) for name, dtype in LAYER_SPECS.items()
+        })
+        self.pool = None
+
+    def __enter__(self):
+        self.pool = ProcessPoolExecutor(
+            self.workers,
+            initializer=_init_worker,
+            initargs=(self.generator, self.shared.describe())
+        )
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.pool.shutdown()
+        self.shared.close()
+
+    def generate_layers(self):
+        height = self.generator.output_size[1]
+        bands = split_rows(height, self.workers * 4)
+        list(self.pool.map(_layers_task, bands))
+
+        shared = self.shared
+        layers = {name: shared[name].copy() for name in CLASSIFIED}
+        layers['resources'] = {name: shared[name].copy() for name in RESOURCE_TYPES}
+        return shared['elevation'].copy(), shared['temperature'].copy(), layers
+
+    def _publish(self, world):
+        # Everything the workers composite from, planned here or loaded from
+        # the stage cache (then generate_layers never filled the shared arrays)
+        shared = self.shared
+        for name in ('elevation', 'temperature', 'rivers', 'river_widths', 'roads'):
+            shared[name][...] = world[name]
+        for name in CLASSIFIED:
+            shared[name][...] = world['layers'][name]
+        for name in RESOURCE_TYPES:
+            shared[name][...] = world['layers']['resources'][name]
+
+    def composite_bands(self, world, bands):
+        """Yield (rows, image) for each band, rendered in parallel, in order.
+
+        Each yielded image is a view into a shared buffer that is released
+        once the next batch starts, so consume (or copy) it straight away.
+        """
+        self._publish(world)
+        size = self.generator.tile_size
+        width = self.generator.output_size[0] * size
+        batch = self.workers
+        for start in range(0, len(bands), batch):
+            group = bands[start:start + batch]
+            total = sum(y1 - y0 for y0, y1 in group) * size
+            output = SharedArrays({'image': ((total, width, 4), np.uint8)})
+            try:
+                target = output.describe()['image']
+                futures = []
+                offset = 0
+                for rows in group:
+                    futures.append(self.pool.submit(
+                        _composite_task, rows, world['settlements'], target, offset
+                    ))
+                    offset += (rows[1] - rows[0]) * size
+                for future in futures:
+                    future.result()
+                offset = 0
+                for y0, y1 in group:
+                    end = offset + (y1 - y0) * size
+                    yield (y0, y1), output['image'][offset:end]
+                    offset = end
+            finally:
+                output.close()
+
+    def composite_world(self, world):
+        size = self.generator.tile_size
+        width, height = self.generator.output_size
+        image = np.empty((height * size, width * size, 4), dtype=np.uint8)
+        bands = split_rows(height, self.workers * 2)
+        for (y0, y1), band in self.composite_bands(world, bands):
+            image[y0 * size:y1 * size] = band
+        return image
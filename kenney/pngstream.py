@@ -0,0 +1,233 @@
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# IHDR colour types
+COLOR_PALETTE = 3
+COLOR_RGBA = 6
+
+# Scanline filter types; FILTER_ADAPTIVE picks the best of them per row
+FILTER_NONE = 0
+FILTER_SUB = 1
+FILTER_UP = 2
+FILTER_AVERAGE = 3
+FILTER_PAETH = 4
+FILTER_ADAPTIVE = 5
+
+ZLIB_HEADER = b'\x78\x9c'
+HASH_BITS = 16
+
+
+def palette_hash(keys):
+    """Multiplier that sends every packed RGBA key to its own HASH_BITS slot."""
+    keys = keys.astype(np.uint32)
+    rng = np.random.default_rng(0)
+    for _ in range(1000):
+        multiplier = np.uint32(rng.integers(1 << 31) * 2 + 1)
+        slots = (keys * multiplier) >> np.uint32(32 - HASH_BITS)
+        if len(np.unique(slots)) == len(keys):
+            return multiplier, slots
+    raise ValueError('no collision-free palette hash found')
+
+
+def filter_scanlines(rows, previous, bpp, filter_type):
+    """Filter (n, stride) raw scanlines; returns (n, stride + 1) with filter bytes.
+
+    previous is the raw scanline above the first row (zeros at the top of
+    the image). Filters only read raw bytes, so every row is filtered at
+    once with whole-array arithmetic.
+    """
+    count, stride = rows.shape
+    out = np.empty((count, stride + 1), dtype=np.uint8)
+    if filter_type in (FILTER_NONE, FILTER_SUB, FILTER_UP):
+        # Byte arithmetic wraps modulo 256 exactly as the filters require
+        out[:, 0] = filter_type
+        if filter_type == FILTER_NONE:
+            out[:, 1:] = rows
+        elif filter_type == FILTER_SUB:
+            out[:, 1:bpp + 1] = rows[:, :bpp]
+            np.subtract(rows[:, bpp:], rows[:, :-bpp], out=out[:, bpp + 1:])
+        else:
+            np.subtract(rows[:1], previous.astype(np.uint8), out=out[:1, 1:])
+            np.subtract(rows[1:], rows[:-1], out=out[1:, 1:])
+        return out
+
+    raw = rows.astype(np.int16)
+    up = np.empty_like(raw)
+    up[0] = previous
+    up[1:] = raw[:-1]
+    left = np.zeros_like(raw)
+    left[:, bpp:] = raw[:, :-bpp]
+    upleft = np.zeros_like(raw)
+    upleft[:, bpp:] = up[:, :-bpp]
+
+    def paeth():
+        p = left + up - upleft
+        pa, pb, pc = np.abs(p - left), np.abs(p - up), np.abs(p - upleft)
+        return raw - np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upleft))
+
+    filters = {
+        FILTER_NONE: lambda: raw,
+        FILTER_SUB: lambda: raw - left,
+        FILTER_UP: lambda: raw - up,
+        FILTER_AVERAGE: lambda: raw - (left + up) // 2,
+        FILTER_PAETH: paeth,
+    }
+    if filter_type != FILTER_ADAPTIVE:
+        out[:, 0] = filter_type
+        out[:, 1:] = filters[filter_type]() & 0xFF
+        return out
+
+    # Usual heuristic: per row, the filter with the smallest sum of |signed bytes|
+    candidates = np.stack([(f() & 0xFF).astype(np.uint8) for f in filters.values()])
+    score = np.abs(candidates.astype(np.int8).astype(np.int32)).sum(axis=2)
+    best = score.argmin(axis=0)
+    out[:, 0] = best
+    out[:, 1:] = candidates[best, np.arange(count)]
+    return out
+
+
+class PNGStreamWriter:
+    """Write a PNG one band of rows at a time.
+
+    Only the rows handed to write_rows are ever held in memory, so an image
+    of any height can be encoded with memory bounded by the band size.
+
+    With a palette ((n, 4) RGBA, n <= 256) the image is written as 8-bit
+    palette-indexed; RGBA rows are mapped to indices on the fly and must
+    only use palette colours, so the file decodes bit-exact to them.
+    filter_type, compress_level and strategy tune the deflate trade-off.
+    threads > 1 deflates each band as that many independent strips in
+    parallel (zlib releases the GIL), joined into one stream with sync
+    flushes, at the cost of the dictionary across strip boundaries.
+    """
+
+    def __init__(self, filename, width, height, compress_level=6, idat_size=1 << 20,
+                 palette=None, filter_type=FILTER_NONE, strategy=zlib.Z_DEFAULT_STRATEGY, threads=1):
+        # Validate the palette before anything is opened, so a bad one leaks nothing
+        if palette is not None:
+            palette = np.ascontiguousarray(palette, dtype=np.uint8).reshape(-1, 4)
+            if not 0 < len(palette) <= 256:
+                raise ValueError(f'palette must have 1-256 colours, got {len(palette)}')
+            if len(np.unique(palette, axis=0)) != len(palette):
+                raise ValueError('palette has duplicate colours')
+            # Perfect hash from packed RGBA to palette index
+            self.palette_keys = palette.view('<u4').ravel()
+            self.hash_multiplier, slots = palette_hash(self.palette_keys)
+            self.hash_table = np.zeros(1 << HASH_BITS, dtype=np.uint8)
+            self.hash_table[slots] = np.arange(len(palette))
+        self.palette = palette
+
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.idat_size = idat_size
+        self.compress_level = compress_level
+        self.strategy = strategy
+        self.filter_type = filter_type
+        self.threads = threads
+        # Raw deflate plus our own zlib framing, so parallel strips can be spliced in
+        self.compressor = self._deflater()
+        self.adler = 1
+        self.pending = [ZLIB_HEADER]
+        self.pending_size = len(ZLIB_HEADER)
+        self.file = open(filename, 'wb')
+        self.pool = ThreadPoolExecutor(threads) if threads > 1 else None
+        self.bpp = 4 if palette is None else 1
+        self.previous = np.zeros(width * self.bpp, dtype=np.int16)
+
+        self.file.write(PNG_SIGNATURE)
+        # 8-bit RGBA or palette, deflate, adaptive filtering, no interlace
+        color_type = COLOR_RGBA if palette is None else COLOR_PALETTE
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+        if palette is not None:
+            self._write_chunk(b'PLTE', palette[:, :3].tobytes())
+            self._write_chunk(b'tRNS', palette[:, 3].tobytes())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._release()
+
+    def _deflater(self):
+        return zlib.compressobj(self.compress_level, zlib.DEFLATED, -15, 9, self.strategy)
+
+    def _write_chunk(self, tag, data):
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(tag)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(tag)) & 0xFFFFFFFF))
+
+    def _flush_idat(self, force=False):
+        if self.pending_size >= self.idat_size or (force and self.pending):
+            self._write_chunk(b'IDAT', b''.join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+
+    def _append(self, data):
+        if data:
+            self.pending.append(data)
+            self.pending_size += len(data)
+            self._flush_idat()
+
+    def indices(self, rows):
+        """Map (n, width, 4) RGBA rows to palette indices."""
+        keys = np.ascontiguousarray(rows).view('<u4')[..., 0]
+        slots = keys * self.hash_multiplier
+        slots >>= np.uint32(32 - HASH_BITS)
+        index = self.hash_table[slots]
+        if not np.array_equal(self.palette_keys[index], keys):
+            raise ValueError('rows use colours that are not in the palette')
+        return index
+
+    def _strip(self, data):
+        compressor = self._deflater()
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def write_rows(self, rows):
+        """Append a band to the image: (rows, width, 4) RGBA, or (rows, width)
+        palette indices when the writer has a palette."""
+        count = rows.shape[0]
+        if self.palette is not None and rows.ndim == 3:
+            rows = self.indices(rows)
+        expected = (self.width, 4) if self.palette is None else (self.width,)
+        if rows.shape[1:] != expected:
+            raise ValueError(f'expected rows of shape (n, {", ".join(map(str, expected))}), got {rows.shape}')
+        if self.rows_written + count > self.height:
+            raise ValueError('more rows written than the image height')
+
+        raw = rows.reshape(count, -1)
+        scanlines = filter_scanlines(raw, self.previous, self.bpp, self.filter_type)
+        self.previous = raw[-1].astype(np.int16)
+        self.adler = zlib.adler32(scanlines, self.adler)
+        if self.pool is None:
+            self._append(self.compressor.compress(scanlines.tobytes()))
+        else:
+            bounds = np.linspace(0, count, self.threads + 1).astype(int)
+            strips = [scanlines[a:b].tobytes() for a, b in zip(bounds, bounds[1:]) if b > a]
+            for data in self.pool.map(self._strip, strips):
+                self._append(data)
+        self.rows_written += count
+
+    def _release(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+        self.file.close()
+
+    def close(self):
+        if self.rows_written != self.height:
+            self._release()
+            raise ValueError(f'only {self.rows_written} of {self.height} rows were written')
+        self._append(self.compressor.flush() if self.pool is None else self._deflater().flush())
+        self._append(struct.pack('>I', self.adler & 0xFFFFFFFF))
+        self._flush_idat(force=True)
+        self._write_chunk(b'IEND', b'')
+        self._release()
@@ -0,0 +1,121 @@
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+MANIFEST = 'pyramid.json'
+TILE_PATH = '{level}/{column}_{row}.png'
+
+
+def box_halve(image):
+    """Halve an (H, W, 4) uint8 image with a 2x2 alpha-weighted box filter.
+
+    Odd edges are padded by repeating the last row or column.
+    """
+    height, width = image.shape[:2]
+    padded = np.pad(image, ((0, height % 2), (0, width % 2), (0, 0)), mode='edge').astype(np.float64)
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2, 4)
+    alpha = blocks[..., 3:].sum(axis=(1, 3))
+    colour = (blocks[..., :3] * blocks[..., 3:]).sum(axis=(1, 3))
+    out = np.zeros(alpha.shape[:2] + (4,))
+    np.divide(colour, alpha, out=out[..., :3], where=alpha > 0)
+    out[..., 3:] = alpha / 4
+    return np.round(out).astype(np.uint8)
+
+
+class PyramidWriter:
+    """Cuts each level of an overview pyramid into tile_pixels-square PNGs.
+
+    Tiles are written as directory/<level>/<column>_<row>.png; edge tiles
+    are cropped to the image, not padded. The manifest (pyramid.json)
+    lists every level's scale and size.
+    """
+
+    def __init__(self, directory, tile_pixels=256, compress_level=6):
+        self.directory = directory
+        self.tile_pixels = tile_pixels
+        self.compress_level = compress_level
+        self.levels = []
+
+    def begin_level(self, level, pixels_per_cell, width, height):
+        os.makedirs(os.path.join(self.directory, str(level)), exist_ok=True)
+        self.levels.append({
+            'level': level,
+            'pixels_per_cell': pixels_per_cell,
+            'width': width,
+            'height': height,
+            'columns': -(-width // self.tile_pixels),
+            'rows': -(-height // self.tile_pixels)
+        })
+
+    def write_band(self, band, row):
+        """Write one row of tiles; band is (<= tile_pixels, width, 4)."""
+        level = self.levels[-1]['level']
+        for column, x0 in enumerate(range(0, band.shape[1], self.tile_pixels)):
+            tile = np.ascontiguousarray(band[:, x0:x0 + self.tile_pixels])
+            path = os.path.join(self.directory, TILE_PATH.format(level=level, column=column, row=row))
+            Image.fromarray(tile, 'RGBA').save(path, compress_level=self.compress_level)
+
+    def write_image(self, image):
+        for row, y0 in enumerate(range(0, image.shape[0], self.tile_pixels)):
+            self.write_band(image[y0:y0 + self.tile_pixels], row)
+
+    def write_manifest(self, map_size, tile_size):
+        with open(os.path.join(self.directory, MANIFEST), 'w') as f:
+            json.dump({
+                'map_size': list(map_size),
+                'tile_size': tile_size,
+                'tile_pixels': self.tile_pixels,
+                'tile_path': TILE_PATH,
+                'levels': self.levels
+            }, f, indent=2)
+
+
+def write_pyramid(generator, world, directory, tile_pixels=256, compress_level=6):
+    """Write an overview pyramid of a planned world and return its levels.
+
+    Level n is the map at 1 / 2**n of full size. While a map cell still
+    covers at least one pixel, levels are composited straight from the
+    terrain and feature grids with a box-filtered copy of the atlas, one
+    band of output tiles at a time. Past that, each level is a 2x2 box
+    filter of the one-pixel-per-cell level, so no level ever touches the
+    full-resolution image. Levels stop once the map fits in one tile.
+    """
+    tile_size = generator.tile_size
+    if tile_size & (tile_size - 1) or tile_pixels % tile_size:
+        raise ValueError('tile_size must be a power of two dividing tile_pixels')
+    width, height = generator.output_size
+    writer = PyramidWriter(directory, tile_pixels, compress_level)
+
+    level = 0
+    atlas = generator.atlas
+    while True:
+        size = atlas.tile_size
+        writer.begin_level(level, size, width * size, height * size)
+        band_cells = tile_pixels // size
+        bands = []
+        for row, y0 in enumerate(range(0, height, band_cells)):
+            rows = (y0, min(y0 + band_cells, height))
+            band = generator.composite_world(world, rows, atlas=atlas)
+            writer.write_band(band, row)
+            if size == 1:
+                bands.append(band)
+        if size == 1 or max(width, height) * size <= tile_pixels:
+            break
+        level += 1
+        atlas = atlas.downsample(2)
+
+    # One pixel per cell from here on: halve until the map fits in a tile
+    if bands:
+        image = np.concatenate(bands)
+        scale = 1.0
+        while max(image.shape[:2]) > tile_pixels:
+            level += 1
+            scale /= 2
+            image = box_halve(image)
+            writer.begin_level(level, scale, image.shape[1], image.shape[0])
+            writer.write_image(image)
+
+    writer.write_manifest(generator.output_size, tile_size)
+    return writer.levels
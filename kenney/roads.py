@@ -0,0 +1,248 @@
+import heapq
+import math
+
+import numpy as np
+
+from classify import WATER_LEVEL
+
+SQRT2 = math.sqrt(2)
+INF = float('inf')
+
+WATER_COST = 8.0   # Fords and bridges are expensive but possible
+ROAD_COST = 0.5    # Multiplier for cells that already carry a road
+
+
+def movement_cost(elevation, roads=None):
+    """Per-cell cost of crossing a tile, precomputed once for the whole map.
+
+    Costs are always >= ROAD_COST, which keeps Dijkstra and the octile A*
+    heuristic valid (the old per-step cost could go negative in lowlands).
+    """
+    cost = 1.0 + 2.0 * np.clip(elevation, 0, None)
+    cost[elevation < WATER_LEVEL] = WATER_COST
+    if roads is not None:
+        cost[roads] *= ROAD_COST
+    return cost
+
+
+class RoadPlanner:
+    """Array-backed shortest paths over a movement-cost grid.
+
+    The grid is stored flat with a one-cell border of impassable cells,
+    so neighbour indices never need bounds checks. Moving between two
+    adjacent cells costs the mean of their costs, times sqrt(2) for
+    diagonal steps, which keeps every edge symmetric.
+    """
+
+    def __init__(self, cost):
+        self.width, self.height = cost.shape
+        self.stride = self.height + 2
+        padded = np.full((self.width + 2, self.height + 2), INF)
+        padded[1:-1, 1:-1] = cost
+        self.cost = padded.ravel().tolist()
+        self.min_cost = float(cost.min())
+        s = self.stride
+        self.steps = [
+            (1, 1.0), (-1, 1.0), (s, 1.0), (-s, 1.0),
+            (s + 1, SQRT2), (s - 1, SQRT2), (-s + 1, SQRT2), (-s - 1, SQRT2)
+        ]
+        self.expanded = 0  # Nodes popped by the last search
+
+    def index(self, pos):
+        return (pos[0] + 1) * self.stride + pos[1] + 1
+
+    def position(self, i):
+        return (i // self.stride - 1, i % self.stride - 1)
+
+    def _unpad(self, values, dtype):
+        grid = np.array(values, dtype=dtype).reshape(self.width + 2, self.height + 2)
+        return grid[1:-1, 1:-1]
+
+    def trace(self, parent, i):
+        # Follow parent links back to the search source
+        path = []
+        while i >= 0:
+            path.append(self.position(i))
+            i = parent[i]
+        return path
+
+    def nearest_sources(self, sources):
+        """Multi-source Dijkstra from every source at once.
+
+        Returns flat dist, parent and label lists; label is the index of the
+        source whose shortest-path tree each cell belongs to.
+        """
+        size = len(self.cost)
+        cost = self.cost
+        dist = [INF] * size
+        parent = [-1] * size
+        label = [-1] * size
+        heap = []
+        for n, pos in enumerate(sources):
+            i = self.index(pos)
+            dist[i] = 0.0
+            label[i] = n
+            heap.append((0.0, i))
+        heapq.heapify(heap)
+
+        expanded = 0
+        while heap:
+            d, i = heapq.heappop(heap)
+            if d > dist[i]:
+                continue
+            expanded += 1
+            ci = cost[i]
+            for offset, step in self.steps:
+                j = i + offset
+                cj = cost[j]
+                if cj == INF:
+                    continue
+                nd = d + step * (ci + cj) * 0.5
+                if nd < dist[j]:
+                    dist[j] = nd
+                    parent[j] = i
+                    label[j] = label[i]
+                    heapq.heappush(heap, (nd, j))
+        self.expanded = expanded
+        return dist, parent, label
+
+    def find_path(self, start, end):
+        """A* with the octile heuristic, which is admissible for these costs."""
+        cost = self.cost
+        goal = self.index(end)
+        gx, gy = end
+        floor = self.min_cost
+        diagonal = (SQRT2 - 2) * floor
+        stride = self.stride
+
+        def heuristic(i):
+            dx = abs(i // stride - 1 - gx)
+            dy = abs(i % stride - 1 - gy)
+            return floor * (dx + dy) + diagonal * min(dx, dy)
+
+        begin = self.index(start)
+        dist = {begin: 0.0}
+        parent = {begin: -1}
+        frontier = [(heuristic(begin), 0.0, begin)]
+        expanded = 0
+        while frontier:
+            _, d, i = heapq.heappop(frontier)
+            if d > dist[i]:
+                continue  # Stale entry: i was reached more cheaply since
+            if i == goal:
+                break
+            expanded += 1
+            ci = cost[i]
+            for offset, step in self.steps:
+                j = i + offset
+                cj = cost[j]
+                if cj == INF:
+                    continue
+                nd = d + step * (ci + cj) * 0.5
+                if nd < dist.get(j, INF):
+                    dist[j] = nd
+                    parent[j] = i
+                    heapq.heappush(frontier, (nd + heuristic(j), nd, j))
+        self.expanded = expanded
+
+        path = []
+        i = goal if goal in parent else -1
+        while i >= 0:
+            path.append(self.position(i))
+            i = parent[i]
+        path.reverse()
+        return path
+
+    def candidate_links(self, dist, label):
+        """Cheapest connection between every pair of touching source regions.
+
+        Each link is (cost, a, b, u, v): the shortest route from source a to
+        source b that crosses from cell u (a's region) into cell v (b's).
+        """
+        dist = self._unpad(dist, np.float64)
+        label = self._unpad(label, np.int64)
+        cost = self._unpad(self.cost, np.float64)
+        width, height = label.shape
+
+        links = []
+        for dx, dy, step in [(1, 0, 1.0), (0, 1, 1.0), (1, 1, SQRT2), (1, -1, SQRT2)]:
+            # Pair every cell with its neighbour at (+dx, +dy) via shifted views
+            xa = slice(0, width - dx)
+            xb = slice(dx, width)
+            ya = slice(max(0, -dy), height - max(0, dy))
+            yb = slice(max(0, dy), height - max(0, -dy))
+            la, lb = label[xa, ya], label[xb, yb]
+            cross = (la != lb) & (la >= 0) & (lb >= 0)
+            if not cross.any():
+                continue
+            ux, uy = np.nonzero(cross)
+            uy = uy + ya.start
+            vx, vy = ux + dx, uy + dy
+            weight = (dist[ux, uy] + dist[vx, vy]
+                      + step * (cost[ux, uy] + cost[vx, vy]) * 0.5)
+            links.append((weight, label[ux, uy], label[vx, vy], ux, uy, vx, vy))
+
+        if not links:
+            return []
+        weight, a, b, ux, uy, vx, vy = (np.concatenate(parts) for parts in zip(*links))
+
+        # Orient pairs (a < b) and keep the cheapest crossing per pair
+        swap = a > b
+        a, b = np.where(swap, b, a), np.where(swap, a, b)
+        ux, vx = np.where(swap, vx, ux), np.where(swap, ux, vx)
+        uy, vy = np.where(swap, vy, uy), np.where(swap, uy, vy)
+        order = np.lexsort((weight, b, a))
+        pair = a[order] * (b.max() + 1) + b[order]
+        first = order[np.unique(pair, return_index=True)[1]]
+        first = first[np.argsort(weight[first], kind='stable')]
+        return [
+            (float(weight[k]), int(a[k]), int(b[k]),
+             (int(ux[k]), int(uy[k])), (int(vx[k]), int(vy[k])))
+            for k in first
+        ]
+
+    def network(self, sources, extra_links=0):
+        """Connect all sources with a minimum spanning tree of shortest routes.
+
+        One multi-source Dijkstra grows a shortest-path tree from every
+        source; touching regions give candidate links and Kruskal keeps the
+        cheapest set that connects everything. Routes that head the same way
+        out of a settlement share the same tree branch, so built road cells
+        are reused. extra_links adds the next-cheapest non-tree links as
+        loops. Returns the road mask and a list of (a, b, path) links, where
+        a and b index sources and path runs from source a to source b.
+        """
+        mask = np.zeros((self.width, self.height), dtype=bool)
+        if not sources:
+            return mask, []
+        dist, parent, label = self.nearest_sources(sources)
+
+        root = list(range(len(sources)))
+
+        def find(n):
+            while root[n] != n:
+                root[n] = root[root[n]]
+                n = root[n]
+            return n
+
+        joined = []
+        spare = []
+        for link in self.candidate_links(dist, label):
+            _, a, b, u, v = link
+            ra, rb = find(a), find(b)
+            if ra == rb:
+                spare.append(link)
+                continue
+            root[ra] = rb
+            joined.append(link)
+        joined.extend(spare[:extra_links])
+
+        links = []
+        for _, a, b, u, v in joined:
+            path = self.trace(parent, self.index(u))[::-1] + self.trace(parent, self.index(v))
+            for pos in path:
+                mask[pos] = True
+            links.append((a, b, path))
+        for pos in sources:
+            mask[pos] = True
+        return mask, links
@@ -0,0 +1,179 @@
+"""Search many seeds for a map that matches given criteria, without rendering.
+
+Each seed is previewed at reduced resolution (noise, biomes, rivers and
+settlements only), summarised as statistics and scored against ranges
+given as name=min:max (either side may be left empty):
+
+    python seedsearch.py --seeds 0:2000 --criteria land_fraction=0.55:0.8 \\
+        --criteria mountain_fraction=:0.08 --criteria river_count=6: --render 1
+
+Seeds are spread over worker processes; the best ones are printed as JSON
+and the top --render of them are generated at full size.
+"""
+import argparse
+import concurrent.futures
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+from classify import classify_terrain, TERRAIN_TYPES, TERRAIN_IDS
+from fbm import fbm_noise
+from hydrology import generate_hydrology, D8
+from settlements import place_settlements, DEFAULT_SPACING, COUNT_STREAM
+
+TILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Tiles')
+
+
+def preview_stats(seed, size=(230, 230), factor=4, noise_scale=100.0, noise_octaves=6,
+                  num_rivers=10, settlement_count=None):
+    """Statistics of the world a seed produces, from a 1 / factor preview.
+
+    The preview samples the same noise field as WorldGenerator at every
+    factor-th cell (the noise scale shrinks with the grid), so fractions
+    match the full map closely; counts and distances are reported in
+    full-size tiles.
+    """
+    shape = (max(1, size[0] // factor), max(1, size[1] // factor))
+    scale = noise_scale / factor
+    elevation, temperature = (
+        fbm_noise(shape, seed, base=base, scale=scale, octaves=noise_octaves,
+                  persistence=0.5, lacunarity=2.0, repeatx=shape[0], repeaty=shape[1])
+        for base in (0, 1)
+    )
+    layers = classify_terrain(elevation, temperature, seed)
+    terrain = layers['terrain']
+
+    # Preview cells stand for factor**2 full cells when thresholding flow
+    hydrology = generate_hydrology(elevation, num_rivers, min_accumulation=max(1, 20 // factor ** 2))
+    rivers = hydrology['rivers']
+    direction = hydrology['direction']
+    xs, ys = np.nonzero(rivers)
+    codes = direction[xs, ys]
+    mouth = codes < 0
+    dx = np.array([d[0] for d in D8])[np.maximum(codes, 0)]
+    dy = np.array([d[1] for d in D8])[np.maximum(codes, 0)]
+    mouth |= ~rivers[np.clip(xs + dx, 0, shape[0] - 1), np.clip(ys + dy, 0, shape[1] - 1)]
+
+    if settlement_count is None:
+        settlement_count = int(np.random.default_rng([seed, COUNT_STREAM]).integers(8, 13))
+    spacing = {kind: max(1, int(round(value / factor))) for kind, value in DEFAULT_SPACING.items()}
+    index = place_settlements(layers['buildable'] & ~rivers, layers['settlement_type'],
+                              settlement_count, seed, spacing)
+    points = np.array(list(index.points), dtype=np.float64).reshape(-1, 2) * factor
+    if len(points) > 1:
+        gaps = np.sqrt(((points[:, None] - points[None]) ** 2).sum(axis=2))
+        np.fill_diagonal(gaps, np.inf)
+        nearest = gaps.min(axis=1)
+        min_spacing, mean_spacing = float(nearest.min()), float(nearest.mean())
+    else:
+        min_spacing = mean_spacing = 0.0
+
+    stats = {
+        'seed': seed,
+        'land_fraction': float((terrain != TERRAIN_IDS['water']).mean()),
+        'river_count': int(mouth.sum()),
+        'river_fraction': float(rivers.mean()),
+        'settlement_count': len(points),
+        'settlement_min_spacing': min_spacing,
+        'settlement_mean_spacing': mean_spacing,
+        'mean_elevation': float(elevation.mean()),
+        'mean_temperature': float(temperature.mean())
+    }
+    counts = np.bincount(terrain.ravel(), minlength=len(TERRAIN_TYPES)) / terrain.size
+    for name, fraction in zip(TERRAIN_TYPES, counts):
+        stats[f'{name}_fraction'] = float(fraction)
+    return stats
+
+
+def score(stats, criteria):
+    """Lower is better; 0 means every criterion holds.
+
+    criteria maps a statistic to (low, high), either of which may be None.
+    Misses are measured relative to the bound, so criteria of different
+    units weigh alike. Among seeds that meet everything, those nearer the
+    middle of the ranges rank first.
+    """
+    total = 0.0
+    for name, (low, high) in criteria.items():
+        value = stats[name]
+        if low is not None and value < low:
+            total += (low - value) / max(abs(low), 1e-9)
+        elif high is not None and value > high:
+            total += (value - high) / max(abs(high), 1e-9)
+        elif low is not None and high is not None and high > low:
+            total += 0.01 * abs(value - (low + high) / 2) / (high - low)
+    return total
+
+
+def _preview(args):
+    seed, options = args
+    return preview_stats(seed, **options)
+
+
+def search(seeds, criteria, top=10, workers=None, **options):
+    """Preview every seed on a process pool; returns the top results by score."""
+    jobs = [(seed, options) for seed in seeds]
+    workers = workers or os.cpu_count()
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_preview, jobs, chunksize=max(1, len(jobs) // (workers * 8))))
+    else:
+        results = [_preview(job) for job in jobs]
+    for stats in results:
+        stats['score'] = score(stats, criteria)
+    results.sort(key=lambda stats: (stats['score'], stats['seed']))
+    return results[:top]
+
+
+def parse_criterion(text):
+    name, _, bounds = text.partition('=')
+    low, _, high = bounds.partition(':')
+    return name, (float(low) if low else None, float(high) if high else None)
+
+
+def parse_seeds(text):
+    if ':' in text:
+        start, stop = text.split(':')
+        return range(int(start), int(stop))
+    return [int(s) for s in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seeds', default='0:1000', help='start:stop range or comma-separated list')
+    parser.add_argument('--criteria', action='append', default=[], type=parse_criterion,
+                        help='name=min:max, e.g. land_fraction=0.5:0.8 (repeatable)')
+    parser.add_argument('--size', default='230,230', help='full map size as width,height')
+    parser.add_argument('--factor', type=int, default=4, help='preview downscale factor')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--workers', type=int, help='processes (default: one per CPU)')
+    parser.add_argument('--render', type=int, default=0, help='render this many of the best seeds')
+    parser.add_argument('--output-dir', default='.')
+    args = parser.parse_args(argv)
+
+    size = tuple(int(s) for s in args.size.split(','))
+    criteria = dict(args.criteria)
+    known = set(preview_stats(0, (8, 8), 1))
+    unknown = set(criteria) - known
+    if unknown:
+        parser.error(f'unknown statistics: {", ".join(sorted(unknown))} '
+                     f'(choose from {", ".join(sorted(known - {"seed"}))})')
+
+    best = search(parse_seeds(args.seeds), criteria, args.top, args.workers,
+                  size=size, factor=args.factor)
+    print(json.dumps(best, indent=2))
+
+    if args.render:
+        from worldgen import WorldGenerator
+        for stats in best[:args.render]:
+            filename = os.path.join(args.output_dir, f'world_{stats["seed"]}.png')
+            WorldGenerator(TILES_PATH, output_size=size, seed=stats['seed']).save_world(filename)
+            print(f'Saved: {filename}')
+    return 0 if best and not math.isinf(best[0]['score']) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
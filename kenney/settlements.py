@@ -0,0 +1,142 @@
+import math
+
+import numpy as np
+
+from classify import SETTLEMENT_TYPES
+
+# Minimum distance (in tiles) kept around each settlement class
+DEFAULT_SPACING = {
+    'village': 8,
+    'city': 16,
+    'outpost': 12
+}
+
+PLACEMENT_STREAM = 201  # Candidate cells
+COUNT_STREAM = 202      # Settlement count when none is given
+
+
+class SettlementIndex:
+    """Grid-hash spatial index over placed settlements.
+
+    Buckets are cell_size tiles wide, so a radius query only visits the
+    handful of buckets it overlaps instead of every settlement.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = max(1, int(cell_size))
+        self.buckets = {}
+        self.points = {}
+        # Bounding box of occupied buckets (never shrunk by removals, so only
+        # ever too large, which is safe for nearest's search limit)
+        self.extent = None
+
+    def __len__(self):
+        return len(self.points)
+
+    def __iter__(self):
+        return iter(self.points.items())
+
+    def _bucket(self, x, y):
+        return (x // self.cell_size, y // self.cell_size)
+
+    def insert(self, x, y, settlement_type):
+        self.points[(x, y)] = settlement_type
+        bx, by = self._bucket(x, y)
+        self.buckets.setdefault((bx, by), []).append((x, y))
+        if self.extent is None:
+            self.extent = (bx, by, bx, by)
+        else:
+            x0, y0, x1, y1 = self.extent
+            self.extent = (min(x0, bx), min(y0, by), max(x1, bx), max(y1, by))
+
+    def remove(self, x, y):
+        settlement_type = self.points.pop((x, y))
+        bucket = self._bucket(x, y)
+        self.buckets[bucket].remove((x, y))
+        if not self.buckets[bucket]:
+            del self.buckets[bucket]
+        if not self.buckets:
+            self.extent = None
+        return settlement_type
+
+    def within(self, x, y, radius):
+        """All settlements within radius tiles of (x, y)."""
+        bx, by = self._bucket(x, y)
+        reach = int(math.ceil(radius / self.cell_size))
+        found = []
+        for ix in range(bx - reach, bx + reach + 1):
+            for iy in range(by - reach, by + reach + 1):
+                for px, py in self.buckets.get((ix, iy), ()):
+                    if (px - x) ** 2 + (py - y) ** 2 <= radius * radius:
+                        found.append((px, py))
+        return found
+
+    def nearest(self, x, y, max_radius=None):
+        """Closest settlement to (x, y) as ((x, y), type, distance), or None.
+
+        Rings of buckets are searched outwards until the best hit is
+        provably closer than anything in the next ring.
+        """
+        if not self.points:
+            return None
+        bx, by = self._bucket(x, y)
+        best = None
+        best_d2 = float('inf')
+        ring = 0
+        if max_radius is None:
+            x0, y0, x1, y1 = self.extent
+            max_ring = max(bx - x0, x1 - bx, by - y0, y1 - by)
+        else:
+            max_ring = int(math.ceil(max_radius / self.cell_size))
+        while ring <= max_ring:
+            for ix in range(bx - ring, bx + ring + 1):
+                for iy in range(by - ring, by + ring + 1):
+                    if max(abs(ix - bx), abs(iy - by)) != ring:
+                        continue
+                    for px, py in self.buckets.get((ix, iy), ()):
+                        d2 = (px - x) ** 2 + (py - y) ** 2
+                        if d2 < best_d2:
+                            best, best_d2 = (px, py), d2
+            # Anything in ring + 1 is at least ring * cell_size away
+            if best is not None and best_d2 <= (ring * self.cell_size) ** 2:
+                break
+            ring += 1
+        if best is None or (max_radius is not None and best_d2 > max_radius ** 2):
+            return None
+        return best, self.points[best], math.sqrt(best_d2)
+
+
+def place_settlements(valid, classes, count, seed, spacing=None, attempts_per_settlement=30):
+    """Poisson-disk placement of up to count settlements.
+
+    valid is a boolean mask of cells that may hold a settlement and
+    classes the uint8 settlement class grid from classification. Two
+    settlements are kept at least max(spacing[a], spacing[b]) tiles apart.
+    Candidates are drawn in one batch from the valid cells, so the work
+    is bounded by count * attempts_per_settlement however crowded the map
+    is; fewer settlements are returned if they do not fit.
+    """
+    spacing = dict(DEFAULT_SPACING, **(spacing or {}))
+    radius = np.array([spacing[name] for name in SETTLEMENT_TYPES], dtype=np.float64)
+    index = SettlementIndex(radius.max())
+
+    xs, ys = np.nonzero(valid)
+    if not len(xs) or count <= 0:
+        return index
+
+    rng = np.random.default_rng([seed, PLACEMENT_STREAM])
+    picks = rng.integers(len(xs), size=count * attempts_per_settlement)
+    for cx, cy in zip(xs[picks].tolist(), ys[picks].tolist()):
+        kind = classes[cx, cy]
+        reach = radius[kind]
+        clear = True
+        for px, py in index.within(cx, cy, radius.max()):
+            other = radius[SETTLEMENT_TYPES.index(index.points[(px, py)])]
+            if (px - cx) ** 2 + (py - cy) ** 2 < max(reach, other) ** 2:
+                clear = False
+                break
+        if clear:
+            index.insert(cx, cy, SETTLEMENT_TYPES[kind])
+            if len(index) == count:
+                break
+    return index
@@ -0,0 +1,93 @@
+from PIL import Image
+import json
+import os
+
+def power_of_two_sizes(max_size):
+    """Candidate sheet sizes up to max_size, smallest area first."""
+    sides = []
+    side = 1
+    while side <= max_size:
+        sides.append(side)
+        side *= 2
+    return sorted(((w, h) for w in sides for h in sides), key=lambda s: (s[0] * s[1], max(s)))
+
+def shelf_pack(items, width, height, padding=1):
+    """Place (name, w, h) items on shelves of a width x height sheet.
+
+    Items should come sorted tallest first. Each shelf is as tall as its
+    first item; padding transparent pixels are kept around every sprite so
+    filtering never samples a neighbour. Returns (placed, leftover), where
+    placed maps names to (x, y, w, h).
+    """
+    placed = {}
+    leftover = []
+    x = y = padding
+    shelf_height = 0
+    for name, w, h in items:
+        if x + w + padding > width:
+            # Start a new shelf below the current one
+            x = padding
+            y += shelf_height + padding
+            shelf_height = 0
+        if x + w + padding > width or y + h + padding > height:
+            leftover.append((name, w, h))
+            continue
+        placed[name] = (x, y, w, h)
+        x += w + padding
+        shelf_height = max(shelf_height, h)
+    return placed, leftover
+
+def pack_sprites(sprites, max_size=2048, padding=1):
+    """Bin-pack named PIL images into as few power-of-two sheets as possible.
+
+    Each sheet is the smallest power-of-two size that holds everything
+    left; when even max_size x max_size is not enough, a full sheet is
+    emitted and packing continues on the next one. Returns a list of
+    ((width, height), {name: (x, y, w, h)}) per sheet.
+    """
+    items = sorted(((name, img.width, img.height) for name, img in sprites.items()),
+                   key=lambda item: (-item[2], -item[1], item[0]))
+    for name, w, h in items:
+        if w + 2 * padding > max_size or h + 2 * padding > max_size:
+            raise ValueError(f"Sprite {name} ({w}x{h}) does not fit a {max_size}px sheet")
+
+    sheets = []
+    while items:
+        for size in power_of_two_sizes(max_size):
+            placed, leftover = shelf_pack(items, size[0], size[1], padding)
+            if not leftover:
+                break
+        else:
+            size = (max_size, max_size)
+            placed, leftover = shelf_pack(items, max_size, max_size, padding)
+        sheets.append((size, placed))
+        items = leftover
+    return sheets
+
+def write_sprite_atlas(sprites, output_dir, name, max_size=2048, padding=1):
+    """Save sprites as packed sheets <name>_<n>.png plus a <name>.json manifest.
+
+    The manifest lists the sheets and, for every sprite, the sheet index
+    and its source rectangle in pixels:
+    {"sheets": [{"file", "width", "height"}], "sprites": {name: {"sheet", "x", "y", "width", "height"}}}
+    Returns the paths of the files written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {'sheets': [], 'sprites': {}}
+    written = []
+    for index, ((width, height), placed) in enumerate(pack_sprites(sprites, max_size, padding)):
+        sheet = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        for sprite_name, (x, y, w, h) in sorted(placed.items()):
+            sheet.paste(sprites[sprite_name], (x, y))
+            manifest['sprites'][sprite_name] = {'sheet': index, 'x': x, 'y': y, 'width': w, 'height': h}
+        filename = f"{name}_{index}.png"
+        sheet.save(os.path.join(output_dir, filename))
+        written.append(os.path.join(output_dir, filename))
+        manifest['sheets'].append({'file': filename, 'width': width, 'height': height})
+        print(f"Saved: {filename} ({width}x{height}, {len(placed)} sprites)")
+
+    with open(os.path.join(output_dir, f"{name}.json"), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    written.append(os.path.join(output_dir, f"{name}.json"))
+    print(f"Saved: {name}.json")
+    return written
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+# Bump when a stage's output format or algorithm changes, to orphan old entries
+PIPELINE_VERSION = 4
+
+
+def stage_key(stage, params, inputs=()):
+    """Content address of a stage result.
+
+    The key covers the stage name, the parameters the stage reads and the
+    keys of the upstream results it consumes, so changing any knob changes
+    the key of that stage and of everything downstream of it.
+    """
+    blob = json.dumps({
+        'version': PIPELINE_VERSION,
+        'stage': stage,
+        'params': params,
+        'inputs': list(inputs)
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class StageCache:
+    """On-disk, content-addressed store of pipeline stage results.
+
+    Each result is one pickle file named by its key. When the store grows
+    past max_bytes, the least recently used files are evicted; a cache hit
+    refreshes the file's timestamp.
+    """
+
+    def __init__(self, path, max_bytes=2 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, f'{key}.pkl')
+
+    def load(self, key):
+        filename = self._file(key)
+        try:
+            with open(filename, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        os.utime(filename)
+        self.hits += 1
+        return value
+
+    def store(self, key, value):
+        # Write to a temporary file first so readers never see half an entry
+        fd, temp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, self._file(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith('.pkl'):
+                continue
+            # Another writer sharing the directory may evict the same files
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        entries.sort()
+        while total > self.max_bytes and entries:
+            _, size, name = entries.pop(0)
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(self.path, name))
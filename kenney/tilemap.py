@@ -0,0 +1,92 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+# Sheet layout, see Tilesheet.txt
+TILE_COLUMNS = 12
+TILE_ROWS = 11
+TILE_SIZE = 16        # Native tile size of the sheet and the tile files
+PACKED_SPACING = 0    # Tilemap/tilemap_packed.png
+SPACED_SPACING = 1    # Tilemap/tilemap.png
+
+CACHE_DIR = '.atlas_cache'
+
+
+def tile_names(count):
+    """Name -> index table matching the Tiles/tile_XXXX.png file names."""
+    return {f'tile_{i:04d}': i for i in range(count)}
+
+
+def slice_tilemap(sheet, tile_size=16, spacing=PACKED_SPACING,
+                  columns=TILE_COLUMNS, rows=TILE_ROWS):
+    """Cut an RGBA sheet into a contiguous (rows * columns, size, size, 4) array."""
+    pitch = tile_size + spacing
+    tiles = np.empty((rows * columns, tile_size, tile_size, 4), dtype=np.uint8)
+    for row in range(rows):
+        for col in range(columns):
+            y, x = row * pitch, col * pitch
+            tiles[row * columns + col] = sheet[y:y + tile_size, x:x + tile_size]
+    return tiles
+
+
+def _file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _check_tile_size(tile_size):
+    if tile_size != TILE_SIZE:
+        raise ValueError(f'tile_size must be {TILE_SIZE} to match the tileset, got {tile_size}')
+
+
+def load_tilemap(path, tile_size=16, spacing=PACKED_SPACING, cache_dir=None):
+    """Load a tile sheet as a read-only (n, size, size, 4) array plus a name table.
+
+    The decoded tiles are cached as a .npy file next to the sheet (or in
+    cache_dir) and memory-mapped on later loads. The cache file name holds
+    the sheet's SHA-256, so editing the sheet invalidates it; stale cache
+    files for the same sheet are removed when a new one is written.
+    tile_size must be the sheet's native TILE_SIZE; tiles are not resampled.
+    """
+    _check_tile_size(tile_size)
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR)
+    prefix = f'{os.path.splitext(os.path.basename(path))[0]}-{tile_size}-{spacing}-'
+    cached = os.path.join(cache_dir, f'{prefix}{_file_digest(path)[:16]}.npy')
+
+    if os.path.exists(cached):
+        tiles = np.load(cached, mmap_mode='r')
+        return tiles, tile_names(len(tiles))
+
+    sheet = np.asarray(Image.open(path).convert('RGBA'))
+    tiles = slice_tilemap(sheet, tile_size, spacing)
+    os.makedirs(cache_dir, exist_ok=True)
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and name.endswith('.npy'):
+            os.remove(os.path.join(cache_dir, name))
+    fd, temp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, tiles)
+    os.replace(temp, cached)
+    return np.load(cached, mmap_mode='r'), tile_names(len(tiles))
+
+
+def load_tile_files(tiles_path, numbers, tile_size=16):
+    """Fallback when no sheet is available: decode the individual tile files.
+
+    Returns a (n, size, size, 4) array and a name -> index table covering
+    the requested tile numbers that exist on disk.
+    """
+    _check_tile_size(tile_size)
+    images = []
+    names = {}
+    for number in numbers:
+        tile_path = os.path.join(tiles_path, f'tile_{number}.png')
+        if os.path.exists(tile_path) and f'tile_{number}' not in names:
+            names[f'tile_{number}'] = len(images)
+            images.append(np.asarray(Image.open(tile_path).convert('RGBA')))
+    if not images:
+        return np.zeros((0, tile_size, tile_size, 4), dtype=np.uint8), names
+    return np.stack(images), names
@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+
+
+def current_rss():
+    """Resident set size of this process in bytes (None where unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Span:
+    """One timed region; item counts can be added while it is open."""
+
+    __slots__ = ('tracer', 'name', 'counts', 'start', 'rss', 'depth')
+
+    def __init__(self, tracer, name, counts):
+        self.tracer = tracer
+        self.name = name
+        self.counts = counts
+
+    def count(self, key, value=1):
+        self.counts[key] = self.counts.get(key, 0) + value
+
+    def __enter__(self):
+        self.depth = self.tracer._enter()
+        self.rss = current_rss()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        rss = current_rss()
+        self.tracer._record(self, end, None if rss is None or self.rss is None else rss - self.rss)
+        return False
+
+
+class Tracer:
+    """Records spans around pipeline stages.
+
+    Use it as `with tracer.span('roads') as span: span.count('nodes', n)`.
+    Finished spans can be written as a Chrome/Perfetto trace-event file
+    (write_chrome_trace) or summarised as text (summary).
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.events = []
+        self.origin = time.perf_counter_ns()
+        self.local = threading.local()
+
+    def span(self, name, **counts):
+        return Span(self, name, counts)
+
+    def _enter(self):
+        depth = getattr(self.local, 'depth', 0)
+        self.local.depth = depth + 1
+        return depth
+
+    def _record(self, span, end, rss_delta):
+        self.local.depth = span.depth
+        self.events.append({
+            'name': span.name,
+            'start_ns': span.start - self.origin,
+            'duration_ns': end - span.start,
+            'rss_delta': rss_delta,
+            'depth': span.depth,
+            'tid': threading.get_ident(),
+            'counts': dict(span.counts)
+        })
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = []
+        for event in self.events:
+            args = dict(event['counts'])
+            if event['rss_delta'] is not None:
+                args['rss_delta_bytes'] = event['rss_delta']
+            events.append({
+                'name': event['name'],
+                'cat': 'worldgen',
+                'ph': 'X',
+                'ts': event['start_ns'] / 1000,
+                'dur': event['duration_ns'] / 1000,
+                'pid': pid,
+                'tid': event['tid'],
+                'args': args
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self):
+        """Per-stage totals as an aligned text table, in first-seen order."""
+        totals = {}
+        for event in self.events:
+            total = totals.setdefault(event['name'], {
+                'calls': 0, 'duration_ns': 0, 'rss_delta': 0,
+                'depth': event['depth'], 'counts': {}
+            })
+            total['calls'] += 1
+            total['duration_ns'] += event['duration_ns']
+            total['rss_delta'] += event['rss_delta'] or 0
+            for key, value in event['counts'].items():
+                total['counts'][key] = total['counts'].get(key, 0) + value
+
+        lines = [f'{"stage":<28} {"calls":>5} {"time (ms)":>10} {"rss delta (MB)":>15}  counts']
+        for name, total in totals.items():
+            counts = ', '.join(f'{k}={v}' for k, v in total['counts'].items())
+            label = '  ' * total['depth'] + name
+            lines.append(
+                f'{label:<28} {total["calls"]:>5} {total["duration_ns"] / 1e6:>10.1f} '
+                f'{total["rss_delta"] / (1 << 20):>15.1f}  {counts}'
+            )
+        return '\n'.join(lines)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def count(self, key, value=1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class NullTracer:
+    """Tracer that records nothing; span() returns one shared no-op object."""
+
+    enabled = False
+    _span = _NullSpan()
+
+    def span(self, name, **counts):
+        return self._span
+
+    def summary(self):
+        return ''
+
+
+NULL_TRACER = NullTracer()
@@ -1,5 +1,6 @@
 from PIL import Image, ImageDraw, ImageFont
 import os
+from spriteatlas import write_sprite_atlas
 
 def create_ui_button(width, height, text, color=(52, 152, 219), hover=False):
     """Create a button with Kenney.nl style"""
@@ -26,8 +27,13 @@ def create_ui_button(width, height, text, color=(52, 152, 219), hover=False):
     
     return img
 
-def create_navigation_ui(output_dir="NavigationUI"):
-    """Generate Rimworld-style navigation UI elements"""
+def create_navigation_ui(output_dir="NavigationUI", atlas=False):
+    """Generate Rimworld-style navigation UI elements
+
+    With atlas=True the panel and every button (normal and hover) are packed
+    into power-of-two sheets with a nav_ui.json manifest of source rectangles.
+    Returns the paths of the files written.
+    """
     os.makedirs(output_dir, exist_ok=True)
     print(f"Saving UI elements to: {os.path.abspath(output_dir)}")
     
@@ -106,21 +112,31 @@ def create_navigation_ui(output_dir="NavigationUI"):
                   fill=background_color,
                   outline=(52, 152, 219))
     
-    # Save panel
-    panel.save(os.path.join(output_dir, 'nav_panel_bg.png'))
-    print("Saved: nav_panel_bg.png")
-    
-    # Generate and save all buttons
+    # Generate all buttons
+    rendered = {}
     for filename, properties in buttons.items():
-        button = create_ui_button(
+        rendered[filename] = create_ui_button(
             properties['size'][0],
             properties['size'][1],
             filename.split('.')[0],
             properties['color'],
             properties.get('hover', False)
         )
-        button.save(os.path.join(output_dir, filename))
-        print(f"Saved: {filename}")
+
+    if atlas:
+        sprites = {'nav_panel_bg': panel}
+        sprites.update((filename.split('.')[0], button) for filename, button in rendered.items())
+        written = write_sprite_atlas(sprites, output_dir, 'nav_ui')
+    else:
+        # Save panel
+        panel.save(os.path.join(output_dir, 'nav_panel_bg.png'))
+        written = [os.path.join(output_dir, 'nav_panel_bg.png')]
+        print("Saved: nav_panel_bg.png")
+
+        for filename, button in rendered.items():
+            button.save(os.path.join(output_dir, filename))
+            written.append(os.path.join(output_dir, filename))
+            print(f"Saved: {filename}")
 
     # Modified preview section
     preview_width = 1920  # Standard widescreen width
@@ -146,22 +162,20 @@ def create_navigation_ui(output_dir="NavigationUI"):
     # Center buttons horizontally
     current_x = (preview_width - total_buttons_width) // 2
     
-    # Place non-hover buttons only
+    # Place non-hover buttons only, reusing the renders saved above
     for filename, properties in buttons.items():
         if not filename.endswith('_hover.png'):
-            button = create_ui_button(
-                properties['size'][0],
-                properties['size'][1],
-                filename.split('.')[0],
-                properties['color']
-            )
+            button = rendered[filename]
             preview.paste(button, (current_x, button_y), button)
             current_x += properties['size'][0] + spacing
     
     # Save preview
     preview.save(os.path.join(output_dir, 'nav_ui_preview.png'))
+    written.append(os.path.join(output_dir, 'nav_ui_preview.png'))
     print("Saved: nav_ui_preview.png")
+    return written
 
 if __name__ == "__main__":
-    create_navigation_ui()
+    import sys
+    create_navigation_ui(atlas='--atlas' in sys.argv)
     print("Navigation UI elements generated successfully!")
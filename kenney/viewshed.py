@@ -0,0 +1,179 @@
+import numpy as np
+
+from classify import WATER_LEVEL
+
+DEFAULT_RADIUS = 24
+VERTICAL_SCALE = 20.0     # Tiles of height per unit of elevation
+OBSERVER_HEIGHT = 1.5     # Eye height above the ground, in tiles (a watchtower)
+TARGET_HEIGHT = 0.5       # Height that must be in sight to spot a tile (a rider)
+NO_SETTLEMENT = 0xFFFFFFFF
+BATCH = 256               # Observers swept together; bounds the horizon arrays
+
+
+def _rings(radius):
+    """Per ring of Chebyshev radius r: the ring's offsets and, for each, the two
+    ring r - 1 cells its sight line crosses between, with the blend weight.
+
+    Cells are flat indices into the (2 * radius + 1)**2 window, [dx, dy] order.
+    """
+    side = 2 * radius + 1
+    rings = []
+    for r in range(1, radius + 1):
+        span = np.arange(-r, r + 1)
+        dx = np.concatenate([np.full(2 * r + 1, -r), np.full(2 * r + 1, r), span[1:-1], span[1:-1]])
+        dy = np.concatenate([span, span, np.full(2 * r - 1, -r), np.full(2 * r - 1, r)])
+        # Where the line to (dx, dy) crosses ring r - 1, along the dominant axis
+        major = np.abs(dx) >= np.abs(dy)
+        along = np.where(major, dy, dx) * (r - 1) / r
+        low = np.floor(along)
+        weight = along - low
+        low = low.astype(np.int64)
+        high = np.minimum(low + 1, r - 1)
+        fixed = np.where(major, np.sign(dx), np.sign(dy)) * (r - 1)
+        ax = np.where(major, fixed, low)
+        ay = np.where(major, low, fixed)
+        bx = np.where(major, fixed, high)
+        by = np.where(major, high, fixed)
+        rings.append({
+            'dx': dx, 'dy': dy,
+            'cells': (dx + radius) * side + dy + radius,
+            'a': (ax + radius) * side + ay + radius,
+            'b': (bx + radius) * side + by + radius,
+            'weight': weight,
+            'distance': np.hypot(dx, dy),
+        })
+    return rings
+
+
+def viewsheds(elevation, observers, radius=DEFAULT_RADIUS,
+              observer_height=OBSERVER_HEIGHT, target_height=TARGET_HEIGHT):
+    """Visibility windows for a list of (x, y) observers over an elevation grid.
+
+    Returns a bool array (n, 2 * radius + 1, 2 * radius + 1): [i, radius + dx,
+    radius + dy] is whether a target standing target_height above tile
+    (x + dx, y + dy) is in sight of an eye observer_height above observer i,
+    within radius tiles. Water is treated as a flat surface at sea level.
+
+    Horizon sweep (XDraw): rings of growing Chebyshev radius are walked
+    outward, and each cell's horizon, the steepest slope seen on the way
+    to it, is interpolated from the two cells of the previous ring that
+    its sight line passes between. A ring is a few array operations for
+    every observer at once, so the cost is O(radius) passes over
+    (observers, ring) arrays rather than a ray per cell.
+    """
+    ground = np.maximum(elevation, WATER_LEVEL) * VERTICAL_SCALE
+    width, height = ground.shape
+    side = 2 * radius + 1
+    observers = np.asarray(observers, dtype=np.int64).reshape(-1, 2)
+    visible = np.zeros((len(observers), side * side), dtype=bool)
+    rings = _rings(radius)
+
+    for start in range(0, len(observers), BATCH):
+        ox, oy = observers[start:start + BATCH].T
+        eye = ground[ox, oy] + observer_height
+        # Steepest slope seen from the eye up to each cell; the observer's own cell never blocks
+        horizon = np.full((len(ox), side * side), -np.inf)
+        horizon[:, radius * side + radius] = -1e30
+        shown = visible[start:start + BATCH]
+        shown[:, radius * side + radius] = True
+        for ring in rings:
+            tx = ox[:, None] + ring['dx']
+            ty = oy[:, None] + ring['dy']
+            inside = (tx >= 0) & (tx < width) & (ty >= 0) & (ty < height)
+            level = ground[np.clip(tx, 0, width - 1), np.clip(ty, 0, height - 1)] - eye[:, None]
+            weight = ring['weight']
+            before = horizon[:, ring['a']] * (1 - weight) + horizon[:, ring['b']] * weight
+            shown[:, ring['cells']] = inside & ((level + target_height) / ring['distance'] >= before)
+            horizon[:, ring['cells']] = np.maximum(before, level / ring['distance'])
+
+    # Round the square windows off to the sight radius
+    dx, dy = np.meshgrid(np.arange(-radius, radius + 1), np.arange(-radius, radius + 1), indexing='ij')
+    visible &= (dx * dx + dy * dy <= radius * radius).ravel()
+    return visible.reshape(-1, side, side)
+
+
+def watch_points(elevation, spacing):
+    """The highest land cell of every spacing x spacing block, as (x, y) rows.
+
+    Blocks that are all water get no point.
+    """
+    width, height = elevation.shape
+    bw, bh = -(-width // spacing), -(-height // spacing)
+    padded = np.full((bw * spacing, bh * spacing), -np.inf)
+    padded[:width, :height] = np.where(elevation >= WATER_LEVEL, elevation, -np.inf)
+    blocks = padded.reshape(bw, spacing, bh, spacing).transpose(0, 2, 1, 3).reshape(bw, bh, -1)
+    best = blocks.argmax(axis=2)
+    bx, by = np.nonzero(np.isfinite(blocks.max(axis=2)))
+    best = best[bx, by]
+    return np.stack([bx * spacing + best // spacing, by * spacing + best % spacing], axis=1)
+
+
+class Viewsheds:
+    """Packed visibility windows of settlements and watch points.
+
+    Observer i sees the tiles set in its (2 * radius + 1)**2 window centred
+    on it, stored as one packbits row of (dy, dx) row-major bits, so a
+    spotting check is a bounds test and one bit read, and a settlement's
+    viewshed costs radius**2 / 2 bytes however large the map is.
+    observers rows are (x, y, settlement index), the index being
+    NO_SETTLEMENT for watch points.
+    """
+
+    def __init__(self, radius, observers, bits):
+        self.radius = radius
+        self.side = 2 * radius + 1
+        self.observers = observers
+        self.bits = bits
+
+    @classmethod
+    def build(cls, elevation, settlement_points, radius=DEFAULT_RADIUS, watch_spacing=None):
+        """Viewsheds of every settlement, plus watch points every watch_spacing tiles."""
+        rows = [(x, y, i) for i, (x, y) in enumerate(settlement_points)]
+        if watch_spacing:
+            rows += [(x, y, NO_SETTLEMENT) for x, y in watch_points(elevation, watch_spacing)]
+        observers = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        windows = viewsheds(elevation, observers[:, :2], radius)
+        # Rows of the window are dy, as in the world file's (height, width) grids
+        bits = np.packbits(windows.transpose(0, 2, 1).reshape(len(windows), -1), axis=1)
+        return cls(radius, observers, bits)
+
+    def __len__(self):
+        return len(self.observers)
+
+    def window(self, i):
+        """Observer i's visibility as a (2 * radius + 1) square bool grid indexed [dx, dy]."""
+        flat = np.unpackbits(self.bits[i], count=self.side * self.side).astype(bool)
+        return flat.reshape(self.side, self.side).T
+
+    def can_see(self, i, x, y):
+        ox, oy, _ = self.observers[i]
+        dx, dy = x - int(ox) + self.radius, y - int(oy) + self.radius
+        if not (0 <= dx < self.side and 0 <= dy < self.side):
+            return False
+        bit = dy * self.side + dx
+        return bool(self.bits[i, bit >> 3] >> (7 - (bit & 7)) & 1)
+
+    def seen_by(self, x, y):
+        """Indices of every observer that sees tile (x, y)."""
+        dx = x - self.observers[:, 0].astype(np.int64) + self.radius
+        dy = y - self.observers[:, 1].astype(np.int64) + self.radius
+        near = np.nonzero((dx >= 0) & (dx < self.side) & (dy >= 0) & (dy < self.side))[0]
+        bit = dy[near] * self.side + dx[near]
+        seen = self.bits[near, bit >> 3] >> (7 - (bit & 7)) & 1
+        return near[seen.astype(bool)]
+
+    def sections(self):
+        """The viewsheds as 2D arrays for write_world_file's extra_sections."""
+        return {
+            'view_meta': np.array([[self.radius]], dtype='<u4'),
+            'view_observers': self.observers.astype('<u4'),
+            'view_bits': np.ascontiguousarray(self.bits, dtype='<u1'),
+        }
+
+    @classmethod
+    def from_world_file(cls, world_file):
+        """Load the viewsheds exported into a WorldFile (see sections)."""
+        s = world_file.sections
+        if 'view_meta' not in s:
+            raise ValueError('world file has no viewsheds')
+        return cls(int(s['view_meta'][0, 0]), s['view_observers'], s['view_bits'])
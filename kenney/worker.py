@@ -0,0 +1,390 @@
+"""Long-running generator worker that serves jobs over a local Unix socket.
+
+The worker loads the tile atlas once and keeps noise tables and pipeline
+stage results in memory between jobs, so a small job costs its own work
+and not an interpreter start, imports and load_tiles:
+
+    python worker.py serve --jobs 2 &
+    python worker.py submit generate '{"seed": 7, "size": [120, 120], "output": "w.png"}'
+    python worker.py submit preview '{"seeds": "0:200", "criteria": {"land_fraction": [0.5, 0.8]}}'
+    python worker.py submit sprites '{"target": "ui"}'
+
+The protocol is newline-delimited JSON. A request is
+{"id": ..., "job": "generate" | "preview" | "sprites" | "status", "params": {...}}
+and the worker answers with a stream of events carrying the same id:
+"accepted", progress events ("stage" per pipeline stage, "seed" per
+previewed seed), then one "done" with the result or one "error". Jobs
+from any number of connections run concurrently on --jobs threads; once
+--max-pending jobs are admitted the worker stops reading requests until
+one finishes, so clients that submit faster than it works are held back
+by the socket instead of queueing without bound.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import random
+import signal
+import socket
+import stat
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from tilemap import TILE_SIZE
+from tracing import Tracer
+
+TILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Tiles')
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), f'meadoworld-worker-{os.getuid()}.sock')
+
+# WorldGenerator settings a generate job may set; the rest come from the warm generator
+GENERATOR_OPTIONS = ('seed', 'size', 'noise_scale', 'noise_octaves', 'num_rivers', 'settlement_count',
+                     'settlement_spacing', 'nav_cluster_size', 'distance_fields', 'view_radius',
+                     'watch_spacing')
+SAVE_OPTIONS = ('band_rows', 'data_filename', 'pyramid_dir', 'pyramid_tile', 'encoding')
+
+
+def result_nbytes(value, seen=None):
+    """Array bytes held by a stage result: arrays inside tuples, lists, dicts and objects."""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(result_nbytes(v, seen) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(result_nbytes(v, seen) for v in value)
+    if hasattr(value, '__dict__'):
+        return result_nbytes(vars(value), seen)
+    return sys.getsizeof(value)
+
+
+class MemoryStageCache:
+    """In-memory LRU of stage results in front of an optional on-disk StageCache.
+
+    Same load / store interface as StageCache, and safe to share between
+    the worker's job threads. Results are shared between jobs, not copied.
+    Entries are dropped least recently used first once their arrays pass
+    max_bytes; a result larger than max_bytes on its own (a big render)
+    is only kept by the on-disk cache.
+    """
+
+    def __init__(self, backing=None, max_bytes=1 << 30):
+        self.backing = backing
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, key, value):
+        size = result_nbytes(value)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.nbytes -= self.sizes[key]
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        self.sizes[key] = size
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            old, _ = self.entries.popitem(last=False)
+            self.nbytes -= self.sizes.pop(old)
+
+    def load(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        value = self.backing.load(key) if self.backing is not None else None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._remember(key, value)
+        return value
+
+    def store(self, key, value):
+        with self.lock:
+            self._remember(key, value)
+        if self.backing is not None:
+            self.backing.store(key, value)
+
+
+class StreamTracer(Tracer):
+    """Tracer that also reports every finished stage to a callback as it ends."""
+
+    def __init__(self, emit):
+        super().__init__()
+        self.emit = emit
+
+    def _record(self, span, end, rss_delta):
+        super()._record(span, end, rss_delta)
+        if span.depth <= 1:
+            self.emit({'event': 'stage', 'name': span.name,
+                       'ms': round((end - span.start) / 1e6, 3), 'counts': dict(span.counts)})
+
+
+def _claim_socket(path):
+    # A socket file left by a worker that died can go; a live worker's cannot
+    if not os.path.exists(path):
+        return
+    if not stat.S_ISSOCK(os.stat(path).st_mode):
+        raise RuntimeError(f'{path} exists and is not a socket')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.remove(path)
+            return
+    raise RuntimeError(f'a worker is already listening on {path}')
+
+
+class Worker:
+    """Warm state shared by all jobs: the loaded generator and the stage cache."""
+
+    def __init__(self, jobs=1, max_pending=None, cache_dir=None, cache_bytes=1 << 30):
+        from stagecache import StageCache
+
+        self.jobs = jobs
+        self.max_pending = max_pending or 2 * jobs
+        self.cache = MemoryStageCache(StageCache(cache_dir) if cache_dir else None, cache_bytes)
+        self.base = None
+        self.base_lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(jobs, thread_name_prefix='job')
+        self.completed = 0
+        self.failed = 0
+        self.started = time.time()
+
+    def generator(self):
+        """The warm generator; the atlas is loaded on first use only."""
+        with self.base_lock:
+            if self.base is None:
+                from worldgen import WorldGenerator
+                generator = WorldGenerator(TILES_PATH, tile_size=TILE_SIZE, seed=0)
+                generator.cache = self.cache
+                self.base = generator
+            return self.base
+
+    def job_generator(self, params, emit):
+        # Tiles are never resampled, so only the tileset's own size can be rendered
+        tile_size = params.get('tile_size', TILE_SIZE)
+        if tile_size != TILE_SIZE:
+            raise ValueError(f'tile_size must be {TILE_SIZE} to match the tileset, got {tile_size}')
+        # A shallow copy shares the atlas; only the per-world settings differ
+        base = self.generator()
+        generator = object.__new__(type(base))
+        generator.__dict__.update(base.__dict__)
+        generator.tracer = StreamTracer(emit)
+        for name in GENERATOR_OPTIONS:
+            if name in params:
+                setattr(generator, 'output_size' if name == 'size' else name, params[name])
+        generator.output_size = tuple(generator.output_size)
+        if params.get('seed') is None:
+            generator.seed = random.randrange(2**32)
+        return generator
+
+    def run_generate(self, params, emit):
+        if 'output' not in params:
+            raise ValueError('generate needs an output filename')
+        generator = self.job_generator(params, emit)
+        options = {name: params[name] for name in SAVE_OPTIONS if name in params}
+        generator.save_world(params['output'], **options)
+        return {
+            'seed': generator.seed,
+            'png': params['output'],
+            'mwld': options.get('data_filename') or os.path.splitext(params['output'])[0] + '.mwld'
+        }
+
+    def run_preview(self, params, emit):
+        from seedsearch import preview_stats, score, parse_seeds
+
+        seeds = params.get('seeds', '0:100')
+        seeds = parse_seeds(seeds) if isinstance(seeds, str) else seeds
+        criteria = {name: tuple(bounds) for name, bounds in params.get('criteria', {}).items()}
+        options = {'size': tuple(params.get('size', (230, 230))), 'factor': params.get('factor', 4)}
+        results = []
+        for seed in seeds:
+            stats = preview_stats(seed, **options)
+            stats['score'] = score(stats, criteria)
+            results.append(stats)
+            emit({'event': 'seed', 'stats': stats})
+        results.sort(key=lambda stats: (stats['score'], stats['seed']))
+        return {'best': results[:params.get('top', 10)]}
+
+    def run_sprites(self, params, emit):
+        import build
+
+        target = params.get('target')
+        if target not in ('navigation', 'ui'):
+            raise ValueError(f'unknown sprite target {target!r} (choose navigation or ui)')
+        options = dict(build.TARGETS[target]['params'])
+        options.update({k: v for k, v in params.items() if k != 'target'})
+        return {'outputs': build.TARGETS[target]['action'](options)}
+
+    def run_status(self, params, emit):
+        return {
+            'uptime': round(time.time() - self.started, 3),
+            'jobs': self.jobs,
+            'max_pending': self.max_pending,
+            'completed': self.completed,
+            'failed': self.failed,
+            'warm': self.base is not None,
+            'cache': {'entries': len(self.cache.entries), 'bytes': self.cache.nbytes,
+                      'max_bytes': self.cache.max_bytes, 'hits': self.cache.hits,
+                      'misses': self.cache.misses}
+        }
+
+    async def run_job(self, request, send):
+        job_id = request.get('id')
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def emit(event):
+            # Called from the job thread
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        async def forward():
+            while True:
+                event = await events.get()
+                if event is None:
+                    return
+                await send({'id': job_id, **event})
+
+        action = getattr(self, f'run_{request.get("job")}', None)
+        if action is None:
+            self.failed += 1
+            await send({'id': job_id, 'event': 'error', 'error': f'unknown job {request.get("job")!r}'})
+            return
+        await send({'id': job_id, 'event': 'accepted'})
+        forwarder = asyncio.create_task(forward())
+        start = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(self.executor, action, request.get('params') or {}, emit)
+            final = {'event': 'done', 'result': result}
+            self.completed += 1
+        except Exception as e:
+            final = {'event': 'error', 'error': repr(e)}
+            self.failed += 1
+        events.put_nowait(None)
+        await forwarder
+        final['seconds'] = round(time.perf_counter() - start, 4)
+        await send({'id': job_id, **final})
+
+    async def handle(self, reader, writer, slots):
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def send(message):
+            async with write_lock:
+                try:
+                    writer.write(json.dumps(message).encode('utf-8') + b'\n')
+                    await writer.drain()
+                except ConnectionError:
+                    pass  # Client went away; the job still finishes and warms the cache
+
+        async def run(request):
+            try:
+                await self.run_job(request, send)
+            finally:
+                slots.release()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    await send({'id': None, 'event': 'error', 'error': f'bad request: {e}'})
+                    continue
+                # Backpressure: hold the request, and stop reading, until a job slot is free
+                await slots.acquire()
+                task = asyncio.create_task(run(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    async def serve(self, path):
+        slots = asyncio.Semaphore(self.max_pending)
+        _claim_socket(path)
+        server = await asyncio.start_unix_server(lambda r, w: self.handle(r, w, slots), path)
+        # Stop cleanly on SIGTERM too, so the socket file is removed
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        print(f'Worker listening on {path} ({self.jobs} jobs, {self.max_pending} pending)', flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def submit(job, params=None, path=DEFAULT_SOCKET, job_id=1):
+    """Send one job to a running worker and yield its events as dicts until it ends."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps({'id': job_id, 'job': job, 'params': params or {}}).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as stream:
+            for line in stream:
+                event = json.loads(line)
+                yield event
+                if event['event'] in ('done', 'error'):
+                    return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket path')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='run the worker')
+    serve.add_argument('--jobs', type=int, default=os.cpu_count(), help='jobs run at once')
+    serve.add_argument('--max-pending', type=int, help='jobs admitted before reading stops (default 2 x jobs)')
+    serve.add_argument('--cache-dir', help='on-disk stage cache behind the in-memory one')
+    serve.add_argument('--cache-bytes', type=int, default=1 << 30,
+                       help='memory for stage results kept between jobs (default 1 GiB)')
+    client = commands.add_parser('submit', help='send one job and print its events')
+    client.add_argument('job', choices=['generate', 'preview', 'sprites', 'status'])
+    client.add_argument('params', nargs='?', default='{}', help='job parameters as JSON')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        worker = Worker(args.jobs, args.max_pending, args.cache_dir, args.cache_bytes)
+        worker.generator()  # Warm up before the first request arrives
+        try:
+            asyncio.run(worker.serve(args.socket))
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+        except RuntimeError as e:
+            parser.exit(1, f'{parser.prog}: {e}\n')
+        return 0
+
+    params = json.loads(args.params)
+    # Paths are opened by the worker, so make them independent of its directory
+    for name in ('output', 'data_filename', 'pyramid_dir'):
+        if name in params:
+            params[name] = os.path.abspath(params[name])
+    status = 1
+    for event in submit(args.job, params, args.socket):
+        print(json.dumps(event), flush=True)
+        status = 0 if event['event'] == 'done' else 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""Binary world data file (.mwld) written next to the world PNG.
+
+Layout (all little-endian):
+
+    header    64 bytes   magic 'MWLD', version, section count, width,
+                         height, seed, elevation scale
+    sections  48 bytes   per section: name, dtype, offset, size, rows, cols
+    data                 each section 64-byte aligned, C order
+
+Grids are stored row-major as (height, width), so tile (x, y) lives at
+index y * width + x. Elevation is quantized to int16 (value / scale).
+Consumers can memory-map the file and read tiles directly.
+"""
+import json
+import struct
+
+import numpy as np
+
+from classify import TERRAIN_TYPES, SETTLEMENT_TYPES, SETTLEMENT_IDS, RESOURCE_TYPES
+from fields import NO_OWNER, DISTANCE_SCALE, MAX_DISTANCE
+
+MAGIC = b'MWLD'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIQf36x')
+SECTION = struct.Struct('<16s8sQQII')
+ALIGNMENT = 64
+ELEVATION_SCALE = 32767.0
+
+# Bits of the per-tile 'features' grid
+FEATURE_RIVER = 1
+FEATURE_ROAD = 2
+FEATURE_COAST = 4
+FEATURE_SETTLEMENT = 8
+
+
+def _grid(array, dtype):
+    # Generator maps are indexed [x, y]; store them row-major as (height, width)
+    return np.ascontiguousarray(np.asarray(array).T, dtype=dtype)
+
+
+def world_sections(world, extra_sections=None):
+    """Lay out the sections of a planned world (see WorldGenerator.plan_world)."""
+    layers = world['layers']
+
+    features = (
+        world['rivers'].astype(np.uint8) * FEATURE_RIVER
+        | world['roads'].astype(np.uint8) * FEATURE_ROAD
+        | layers['coast'].astype(np.uint8) * FEATURE_COAST
+    )
+    settlements = np.array(
+        [(x, y, SETTLEMENT_IDS[kind]) for (x, y), kind in world['settlements'].items()],
+        dtype='<u4'
+    ).reshape(-1, 3)
+    for x, y, _ in settlements:
+        features[x, y] |= FEATURE_SETTLEMENT
+
+    # Resource grid holds 1 + index into RESOURCE_TYPES, 0 for none
+    resource_grid = np.zeros(layers['terrain'].shape, dtype=np.uint8)
+    for i, resource_type in enumerate(RESOURCE_TYPES):
+        resource_grid[layers['resources'][resource_type]] = i + 1
+    rx, ry = np.nonzero(resource_grid)
+    resources = np.stack([rx, ry, resource_grid[rx, ry] - 1], axis=1).astype('<u4')
+
+    elevation = np.clip(np.round(world['elevation'] * ELEVATION_SCALE), -32768, 32767)
+    legend = json.dumps({
+        'terrain': TERRAIN_TYPES,
+        'settlement': SETTLEMENT_TYPES,
+        'resource': RESOURCE_TYPES,
+        'features': {'river': FEATURE_RIVER, 'road': FEATURE_ROAD,
+                     'coast': FEATURE_COAST, 'settlement': FEATURE_SETTLEMENT}
+    }).encode('utf-8')
+
+    sections = {
+        'legend': np.frombuffer(legend, dtype=np.uint8).reshape(1, -1),
+        'terrain': _grid(layers['terrain'], '<u1'),
+        'elevation': _grid(elevation, '<i2'),
+        'features': _grid(features, '<u1'),
+        'resource': _grid(resource_grid, '<u1'),
+        'river_width': _grid(world['river_widths'], '<u1'),
+        'settlements': settlements,
+        'resources': resources,
+    }
+    sections.update(extra_sections or {})
+    return sections
+
+
+def write_world_file(filename, world, width, height, seed, extra_sections=None):
+    """Write a planned world as a memory-mappable .mwld file.
+
+    extra_sections maps names to 2D arrays that later stages want to ship
+    in the same file; they are stored exactly like the built-in sections.
+    """
+    sections = world_sections(world, extra_sections)
+    offset = HEADER.size + SECTION.size * len(sections)
+    entries = []
+    for name, array in sections.items():
+        array = np.ascontiguousarray(array)
+        if array.ndim != 2:
+            raise ValueError(f'section {name!r} must be 2D, got shape {array.shape}')
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        entries.append((name, array, offset))
+        offset += array.nbytes
+
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(entries), width, height, seed, ELEVATION_SCALE))
+        for name, array, start in entries:
+            f.write(SECTION.pack(
+                name.encode('ascii'), array.dtype.str.encode('ascii'),
+                start, array.nbytes, array.shape[0], array.shape[1]
+            ))
+        for name, array, start in entries:
+            f.write(b'\0' * (start - f.tell()))
+            f.write(array.tobytes())
+
+
+class WorldFile:
+    """Read-only, memory-mapped view of a .mwld file.
+
+    Sections are exposed as NumPy views straight into the mapping, so
+    opening a file costs a header parse and tile lookups are plain reads.
+    Several processes mapping the same file share one copy in the page cache.
+    """
+
+    def __init__(self, filename):
+        self.data = np.memmap(filename, dtype=np.uint8, mode='r')
+        magic, version, count, width, height, seed, scale = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{filename} is not a world file')
+        if version != VERSION:
+            raise ValueError(f'unsupported world file version {version}')
+        self.version = version
+        self.width = width
+        self.height = height
+        self.seed = seed
+        self.elevation_scale = scale
+
+        self.sections = {}
+        for i in range(count):
+            name, dtype, offset, nbytes, rows, cols = SECTION.unpack_from(
+                self.data, HEADER.size + i * SECTION.size
+            )
+            name = name.rstrip(b'\0').decode('ascii')
+            dtype = np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+            self.sections[name] = np.ndarray(
+                (rows, cols), dtype=dtype, buffer=self.data, offset=offset
+            )
+
+        self.legend = json.loads(self.sections['legend'].tobytes().decode('utf-8'))
+        self.terrain = self.sections['terrain']
+        self.elevation = self.sections['elevation']
+        self.features = self.sections['features']
+        self.resource = self.sections['resource']
+
+    def __getitem__(self, name):
+        return self.sections[name]
+
+    def terrain_at(self, x, y):
+        return self.legend['terrain'][self.terrain[y, x]]
+
+    def elevation_at(self, x, y):
+        return self.elevation[y, x] / self.elevation_scale
+
+    def resource_at(self, x, y):
+        value = self.resource[y, x]
+        return self.legend['resource'][value - 1] if value else None
+
+    def has_river(self, x, y):
+        return bool(self.features[y, x] & FEATURE_RIVER)
+
+    def has_road(self, x, y):
+        return bool(self.features[y, x] & FEATURE_ROAD)
+
+    def owner_at(self, x, y):
+        """Index into settlements() of the settlement whose territory holds (x, y)."""
+        owner = int(self.sections['territory'][y, x])
+        return None if owner == NO_OWNER else owner
+
+    def distance_at(self, feature, x, y):
+        """Tiles from (x, y) to the nearest feature ('settlement', 'city', 'metal', ...)."""
+        value = int(self.sections[f'dist_{feature}'][y, x])
+        return None if value == MAX_DISTANCE else value / DISTANCE_SCALE
+
+    def settlements(self):
+        return [(int(x), int(y), self.legend['settlement'][kind])
+                for x, y, kind in self.sections['settlements']]
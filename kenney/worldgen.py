@@ -1,15 +1,60 @@
 from PIL import Image
 import os
 import random
-import noise
 import numpy as np
-import heapq
+from fbm import fbm_noise
+from classify import classify_terrain, TERRAIN_TYPES, SETTLEMENT_TYPES
+from compositor import TileAtlas, BASE_STREAM, RIVER_STREAM, ROAD_STREAM, SETTLEMENT_STREAM
+from pngstream import PNGStreamWriter
+from worldfile import write_world_file
+from roads import RoadPlanner, movement_cost
+from hydrology import generate_hydrology, river_footprint
+from settlements import place_settlements, COUNT_STREAM
+from parallel import ParallelSession
+from stagecache import StageCache, stage_key
+from tilemap import load_tilemap, load_tile_files
+from tracing import NULL_TRACER
+from pyramid import write_pyramid
+from navgraph import NavGraph
+from fields import distance_fields
+from viewshed import Viewsheds
 
 class WorldGenerator:
-    def __init__(self, tiles_path, output_size=(100, 100), tile_size=16):
+    def __init__(self, tiles_path, output_size=(100, 100), tile_size=16, seed=None,
+                 settlement_spacing=None, workers=1, noise_scale=100.0, noise_octaves=6,
+                 num_rivers=10, settlement_count=None, cache_dir=None, cache_size=2 << 30,
+                 tilemap_path=None, tracer=None, nav_cluster_size=None, distance_fields=False,
+                 view_radius=None, watch_spacing=None):
         self.tiles_path = tiles_path
+        # Stage instrumentation (tracing.Tracer); the default records nothing
+        self.tracer = tracer or NULL_TRACER
+        # Packed tile sheet next to the tile directory (see Tilesheet.txt)
+        self.tilemap_path = tilemap_path or os.path.join(
+            os.path.dirname(os.path.abspath(tiles_path)), 'Tilemap', 'tilemap_packed.png'
+        )
         self.output_size = output_size
         self.tile_size = tile_size
+        self.noise_scale = noise_scale
+        self.noise_octaves = noise_octaves
+        self.num_rivers = num_rivers
+        # Number of settlements; None draws 8-12 from the seed
+        self.settlement_count = settlement_count
+        # On-disk stage cache, so reruns only recompute stages whose inputs changed
+        self.cache = StageCache(cache_dir, cache_size) if cache_dir else None
+        # Process count for noise, classification and compositing (1 = in-process)
+        self.workers = workers
+        # Cluster size of the exported HPA* travel graph (None = no graph)
+        self.nav_cluster_size = nav_cluster_size
+        # Export territory and nearest-feature distance grids (see fields)
+        self.distance_fields = distance_fields
+        # Sight radius of the exported settlement viewsheds (None = no viewsheds),
+        # plus a watch point on the highest land of every watch_spacing block
+        self.view_radius = view_radius
+        self.watch_spacing = watch_spacing
+        # Minimum spacing per settlement class, overriding settlements.DEFAULT_SPACING
+        self.settlement_spacing = settlement_spacing
+        # World seed; every noise layer derives its permutation table from it
+        self.seed = seed if seed is not None else random.randrange(2**32)
         self.tiles = {
             'snow': [],
             'tundra': [],
@@ -46,6 +91,7 @@ class WorldGenerator:
             'forest': ['0016', '0017'],
             'road': ['0040', '0041'],
             'coast': ['0002'],  # Shallow water tiles
+            'river': ['0002'],
             # Settlements
             'settlement': {
                 'village': ['0076'],
@@ -60,284 +106,480 @@ class WorldGenerator:
             }
         }
 
-        # Load base terrain tiles
+        # Flatten the mapping into atlas groups ('grass', 'settlement/city', ...)
+        group_numbers = {}
         for terrain, tile_numbers in terrain_mapping.items():
             if isinstance(tile_numbers, list):
-                for number in tile_numbers:
-                    tile_path = os.path.join(self.tiles_path, f'tile_{number}.png')
-                    if os.path.exists(tile_path):
-                        if terrain not in self.tiles:
-                            self.tiles[terrain] = []
-                        self.tiles[terrain].append(Image.open(tile_path))
+                group_numbers[terrain] = (terrain, None, tile_numbers)
             elif isinstance(tile_numbers, dict):
-                # Handle nested dictionaries (settlements and resources)
                 for subtype, subnumbers in tile_numbers.items():
-                    for number in subnumbers:
-                        tile_path = os.path.join(self.tiles_path, f'tile_{number}.png')
-                        if os.path.exists(tile_path):
-                            self.tiles[terrain][subtype].append(Image.open(tile_path))
-
-    def generate_noise_map(self, scale=100.0, octaves=6):
-        noise_map = np.zeros(self.output_size)
-        for y in range(self.output_size[1]):
-            for x in range(self.output_size[0]):
-                noise_map[x][y] = noise.pnoise2(
-                    x/scale, 
-                    y/scale, 
-                    octaves=octaves, 
-                    persistence=0.5, 
-                    lacunarity=2.0, 
-                    repeatx=self.output_size[0], 
-                    repeaty=self.output_size[1], 
-                    base=random.randint(0, 1000)
-                )
-        return noise_map
+                    group_numbers[f'{terrain}/{subtype}'] = (terrain, subtype, subnumbers)
 
-    def get_biome(self, elevation, temperature):
-        if elevation > 0.6:
-            return 'mountain'
-        if elevation < -0.2:
-            return 'water'
-        
-        if temperature > 0.7:
-            return 'sand'
-        elif temperature < -0.3:
-            return 'snow'
-        elif temperature < 0:
-            return 'tundra'
-        elif random.random() < 0.3:  # 30% chance of forest in temperate areas
-            return 'forest'
-        else:
-            return 'grass'
+        # Slice the packed sheet once (memory-mapped from the atlas cache after
+        # the first run); fall back to the individual tile files without it
+        with self.tracer.span('load_tiles') as span:
+            if os.path.exists(self.tilemap_path):
+                sheet, names = load_tilemap(self.tilemap_path, self.tile_size)
+            else:
+                numbers = [n for _, _, group in group_numbers.values() for n in group]
+                sheet, names = load_tile_files(self.tiles_path, numbers, self.tile_size)
+            span.count('tiles', len(sheet))
+
+        groups = {}
+        for group, (terrain, subtype, numbers) in group_numbers.items():
+            indices = [names[f'tile_{n}'] for n in numbers if f'tile_{n}' in names]
+            groups[group] = indices
+            target = self.tiles[terrain] if subtype is None else self.tiles[terrain][subtype]
+            target.extend(sheet[i] for i in indices)
+
+        self.atlas = TileAtlas(sheet, groups, self.tile_size)
+
+    def __getstate__(self):
+        # Worker processes only need the atlas, not the per-category tile views
+        state = self.__dict__.copy()
+        state.pop('tiles', None)
+        state['tracer'] = NULL_TRACER
+        state['cache'] = None
+        return state
+
+    def generate_noise_map(self, scale=100.0, octaves=6, base=0, shape=None, origin=(0, 0)):
+        # Whole-array fBm; each layer (elevation, temperature, ...) uses its own base
+        return fbm_noise(
+            shape or self.output_size,
+            self.seed,
+            base=base,
+            scale=scale,
+            octaves=octaves,
+            persistence=0.5,
+            lacunarity=2.0,
+            repeatx=self.output_size[0],
+            repeaty=self.output_size[1],
+            origin=origin
+        )
+
+    def generate_layers(self, window=None, bounded=True):
+        """Noise and classification for a window (x0, y0, x1, y1) of the map.
+
+        The window is computed with a one-cell halo, so coast tests along
+        its edges see their real neighbours and any tiling of windows gives
+        exactly the full-map result. With bounded=False the window may lie
+        anywhere: the noise repeats every output_size cells, so the map
+        continues as an endless tiling of itself.
+        """
+        width, height = self.output_size
+        x0, y0, x1, y1 = window or (0, 0, width, height)
+        hx0, hy0, hx1, hy1 = x0 - 1, y0 - 1, x1 + 1, y1 + 1
+        if bounded:
+            hx0, hy0 = max(0, hx0), max(0, hy0)
+            hx1, hy1 = min(width, hx1), min(height, hy1)
+        shape = (hx1 - hx0, hy1 - hy0)
+        origin = (hx0, hy0)
+
+        elevation_map = self.generate_noise_map(
+            self.noise_scale, self.noise_octaves, base=0, shape=shape, origin=origin
+        )
+        temperature_map = self.generate_noise_map(
+            self.noise_scale, self.noise_octaves, base=1, shape=shape, origin=origin
+        )
+        layers = self.classify_world(elevation_map, temperature_map, origin)
+
+        inner = (slice(x0 - hx0, x1 - hx0), slice(y0 - hy0, y1 - hy0))
+        layers['resources'] = {name: mask[inner] for name, mask in layers['resources'].items()}
+        layers = {name: grid if name == 'resources' else grid[inner] for name, grid in layers.items()}
+        return elevation_map[inner], temperature_map[inner], layers
 
     def generate_rivers(self, elevation_map, num_rivers=10):
-        rivers = set()
-        mountain_points = []
-        
-        # Find mountain points as river sources
-        for x in range(self.output_size[0]):
-            for y in range(self.output_size[1]):
-                if elevation_map[x][y] > 0.6:
-                    mountain_points.append((x, y))
-        
-        # Generate rivers from random mountain points
-        for _ in range(min(num_rivers, len(mountain_points))):
-            if not mountain_points:
-                break
-                
-            start = random.choice(mountain_points)
-            mountain_points.remove(start)
-            current = start
-            river = {start}
-            
-            # River flows to lowest neighbor until reaching water
-            while elevation_map[current[0]][current[1]] > -0.2:
-                neighbors = []
-                for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
-                    nx, ny = current[0] + dx, current[1] + dy
-                    if (0 <= nx < self.output_size[0] and 
-                        0 <= ny < self.output_size[1]):
-                        neighbors.append((nx, ny, elevation_map[nx][ny]))
-                
-                if not neighbors:
-                    break
-                    
-                # Move to lowest neighbor
-                next_point = min(neighbors, key=lambda x: x[2])
-                current = (next_point[0], next_point[1])
-                river.add(current)
-                
-            rivers.update(river)
-        
-        return rivers
+        # Depression fill, D8 routing and flow accumulation over the whole map
+        with self.tracer.span('generate_rivers') as span:
+            hydrology = generate_hydrology(elevation_map, num_rivers=num_rivers)
+            span.count('cells', elevation_map.size)
+            span.count('river_cells', int(hydrology['rivers'].sum()))
+        return hydrology['rivers'], hydrology['widths']
 
     def find_path(self, start, end, elevation_map):
-        def heuristic(a, b):
-            # Ensure a and b are tuples
-            return abs(a[0] - b[0]) + abs(a[1] - b[1])
-        
-        def get_neighbors(pos):
-            neighbors = []
-            for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0), 
-                          (1, 1), (-1, 1), (1, -1), (-1, -1)]:
-                nx, ny = pos[0] + dx, pos[1] + dy
-                if (0 <= nx < self.output_size[0] and 
-                    0 <= ny < self.output_size[1]):
-                    # Higher cost for diagonal movement and elevation
-                    cost = 1.4 if dx != 0 and dy != 0 else 1.0
-                    cost += elevation_map[nx][ny] * 2  # Penalty for elevation
-                    neighbors.append(((nx, ny), cost))  # Return position as tuple
-            return neighbors
-        
-        # A* pathfinding
-        frontier = [(0, start)]
-        came_from = {start: None}
-        cost_so_far = {start: 0}
-        
-        while frontier:
-            current_cost, current = heapq.heappop(frontier)
-            
-            if current == end:
-                break
-            
-            for next_pos, cost in get_neighbors(current):
-                new_cost = cost_so_far[current] + cost
-                
-                if next_pos not in cost_so_far or new_cost < cost_so_far[next_pos]:
-                    cost_so_far[next_pos] = new_cost
-                    priority = new_cost + heuristic(next_pos, end)
-                    heapq.heappush(frontier, (priority, next_pos))
-                    came_from[next_pos] = current
-        
-        # Reconstruct path
-        path = []
-        current = end
-        while current is not None:
-            path.append(current)
-            current = came_from.get(current)
-        path.reverse()
+        with self.tracer.span('find_path') as span:
+            planner = RoadPlanner(movement_cost(elevation_map))
+            path = planner.find_path(start, end)
+            span.count('nodes_expanded', planner.expanded)
         return path
 
-    def generate_resources(self, elevation_map, temperature_map):
-        resources = {}
-        
-        # Generate resource deposits based on terrain
-        for x in range(self.output_size[0]):
-            for y in range(self.output_size[1]):
-                if elevation_map[x][y] > 0.5:  # Mountains
-                    if random.random() < 0.1:  # 10% chance
-                        resources[(x, y)] = 'metal'
-                    elif random.random() < 0.05:  # 5% chance
-                        resources[(x, y)] = 'gems'
-                elif elevation_map[x][y] > 0 and temperature_map[x][y] > 0:  # Forested areas
-                    if random.random() < 0.15:  # 15% chance
-                        resources[(x, y)] = 'wood'
-        
-        return resources
-
-    def determine_settlement_type(self, x, y, elevation_map, temperature_map):
-        # Determine settlement type based on location and surrounding resources
-        if elevation_map[x][y] > 0.4:  # Higher elevation
-            return 'outpost'
-        elif temperature_map[x][y] > 0.3:  # Warmer regions
-            return 'city' if random.random() < 0.3 else 'village'
+    def generate_roads(self, settlement_points, elevation_map, extra_links=0, existing_roads=None):
+        # Cost grid is built once; cells already on a road are cheaper to reuse
+        with self.tracer.span('generate_roads') as span:
+            planner = RoadPlanner(movement_cost(elevation_map, existing_roads))
+            sources = list(settlement_points)
+            road_mask, links = planner.network(sources, extra_links)
+            span.count('nodes_expanded', planner.expanded)
+            span.count('links', len(links))
+        if existing_roads is not None:
+            road_mask |= existing_roads
+        # Links keep their settlement endpoints so edits can re-route single roads
+        return road_mask, [(sources[a], sources[b], path) for a, b, path in links]
+
+    def build_navigation(self, elevation_map, road_mask, settlement_points):
+        # Travel graph for parties and caravans; roads are cheaper to follow
+        with self.tracer.span('build_navigation') as span:
+            graph = NavGraph.build(
+                movement_cost(elevation_map, road_mask), list(settlement_points), self.nav_cluster_size
+            )
+            span.count('nodes', len(graph.positions))
+            span.count('edges', len(graph.targets))
+        return graph
+
+    def compute_fields(self, elevation_map, layers, road_mask, settlement_points):
+        # Settlement territories and nearest-feature distances, one sweep pass each
+        with self.tracer.span('compute_fields', cells=elevation_map.size):
+            return distance_fields({
+                'elevation': elevation_map, 'layers': layers,
+                'roads': road_mask, 'settlements': settlement_points
+            })
+
+    def compute_viewsheds(self, elevation_map, settlement_points):
+        # Line of sight from settlements and watch points, packed as bit windows
+        with self.tracer.span('compute_viewsheds') as span:
+            views = Viewsheds.build(elevation_map, list(settlement_points), self.view_radius, self.watch_spacing)
+            span.count('observers', len(views))
+        return views
+
+    def classify_world(self, elevation_map, temperature_map, origin=(0, 0)):
+        # Biomes, coasts, resources and settlement classes in one array pass
+        with self.tracer.span('classify_world', cells_classified=elevation_map.size):
+            return classify_terrain(elevation_map, temperature_map, self.seed, origin)
+
+    def determine_settlement_type(self, x, y, layers):
+        return SETTLEMENT_TYPES[layers['settlement_type'][x, y]]
+
+    def place_settlements(self, layers, river_mask, count=None):
+        # Poisson-disk sampling over buildable land; returns a SettlementIndex
+        if count is None:
+            count = int(np.random.default_rng([self.seed, COUNT_STREAM]).integers(8, 13))
+        valid = layers['buildable'] & ~river_mask
+        return place_settlements(
+            valid, layers['settlement_type'], count, self.seed, self.settlement_spacing
+        )
+
+    def composite_world(self, world, rows=None, columns=None, atlas=None):
+        """Build the world, or a window of it, as an RGBA array.
+
+        world is the dict returned by plan_world. rows=(y0, y1) and
+        columns=(x0, x1) limit the render to those tile rows and columns;
+        variants are hashed from absolute positions, so windows rendered
+        separately line up exactly with a full render. atlas overrides the
+        generator's tiles, e.g. with a downsampled copy for overview levels.
+        """
+        with self.tracer.span('composite_world') as span:
+            return self._composite_world(world, rows, columns, span, atlas or self.atlas)
+
+    def _composite_world(self, world, rows, columns, span, atlas, offset=(0, 0)):
+        # offset is the map position of world's [0, 0] cell when it holds a crop
+        layers = world['layers']
+        width, height = layers['terrain'].shape
+        y0, y1 = rows or (0, height)
+        x0, x1 = columns or (0, width)
+        origin = (x0 + offset[0], y0 + offset[1])
+
+        def window(grid):
+            return grid[x0:x1, y0:y1]
+
+        # Base layer: biome tiles, with resources and coasts taking precedence
+        biome_groups = np.array([atlas.group(name) for name in TERRAIN_TYPES])
+        groups = biome_groups[window(layers['terrain'])]
+        for resource_type in ('wood', 'gems', 'metal'):
+            groups[window(layers['resources'][resource_type])] = atlas.group(f'resources/{resource_type}')
+        groups[window(layers['coast'])] = atlas.group('coast')
+        image = atlas.render(atlas.select(groups, self.seed, BASE_STREAM, origin))
+        span.count('tiles_pasted', groups.size)
+
+        # Overlays are blended in batches, one layer at a time
+        if atlas.has_tiles('river'):
+            river_groups = np.full(groups.shape, atlas.group('river'))
+            # Wide rivers spill into neighbouring cells, so look one cell past the window
+            hx0, hy0 = max(0, x0 - 1), max(0, y0 - 1)
+            footprint = river_footprint(
+                world['river_widths'][hx0:min(width, x1 + 1), hy0:min(height, y1 + 1)]
+            )
+            footprint = footprint[x0 - hx0:x1 - hx0, y0 - hy0:y1 - hy0]
+            atlas.overlay(image, footprint,
+                          atlas.select(river_groups, self.seed, RIVER_STREAM, origin))
+            span.count('tiles_blended', int(footprint.sum()))
+        if atlas.has_tiles('road'):
+            road_groups = np.full(groups.shape, atlas.group('road'))
+            atlas.overlay(image, window(world['roads']),
+                          atlas.select(road_groups, self.seed, ROAD_STREAM, origin))
+            span.count('tiles_blended', int(window(world['roads']).sum()))
+
+        settlement_mask = np.zeros(groups.shape, dtype=bool)
+        settlement_groups = np.zeros_like(groups)
+        for (x, y), settlement_type in world['settlements'].items():
+            if x0 <= x < x1 and y0 <= y < y1:
+                settlement_mask[x - x0, y - y0] = True
+                settlement_groups[x - x0, y - y0] = atlas.group(f'settlement/{settlement_type}')
+        atlas.overlay(
+            image, settlement_mask,
+            atlas.select(settlement_groups, self.seed, SETTLEMENT_STREAM, origin)
+        )
+        span.count('tiles_blended', int(settlement_mask.sum()))
+        return image
+
+    def generate_chunk(self, x0, y0, x1, y1, world=None, render=True):
+        """Layers and rendered tiles for the window [x0, x1) x [y0, y1) alone.
+
+        Everything is derived from the window's coordinates and the seed
+        plus a one-cell halo, so chunks can be made in any order and match
+        the full map exactly. Rivers, roads and settlements need the whole
+        map planned first: pass world (from plan_world) to include them,
+        otherwise the chunk shows terrain only and may lie outside the map
+        (see generate_layers with bounded=False).
+        """
+        width, height = self.output_size
+        inside = 0 <= x0 < x1 <= width and 0 <= y0 < y1 <= height
+        if world is not None and not inside:
+            raise ValueError(f'chunk {(x0, y0, x1, y1)} is outside the planned map')
+        with self.tracer.span('generate_chunk', cells=(x1 - x0) * (y1 - y0)):
+            elevation, temperature, layers = self.generate_layers((x0, y0, x1, y1), bounded=inside)
+        chunk = {'elevation': elevation, 'temperature': temperature, 'layers': layers}
+        shape = elevation.shape
+        if world is None:
+            chunk['rivers'] = chunk['roads'] = np.zeros(shape, dtype=bool)
+            chunk['river_widths'] = np.zeros(shape, dtype=np.uint8)
+            chunk['settlements'] = {}
         else:
-            return 'village'
+            window = (slice(x0, x1), slice(y0, y1))
+            chunk['rivers'] = world['rivers'][window]
+            chunk['roads'] = world['roads'][window]
+            chunk['river_widths'] = world['river_widths'][window]
+            chunk['settlements'] = {
+                (x, y): kind for (x, y), kind in world['settlements'].items()
+                if x0 <= x < x1 and y0 <= y < y1
+            }
 
-    def generate_coastal_features(self, elevation_map):
-        coastal_tiles = set()
-        
-        # Find coastal tiles (where land meets water)
-        for x in range(self.output_size[0]):
-            for y in range(self.output_size[1]):
-                if elevation_map[x][y] > -0.2:  # Land
-                    # Check neighbors for water
-                    for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
-                        nx, ny = x + dx, y + dy
-                        if (0 <= nx < self.output_size[0] and 
-                            0 <= ny < self.output_size[1] and 
-                            elevation_map[nx][ny] < -0.2):
-                            coastal_tiles.add((x, y))
-                            break
-        
-        return coastal_tiles
+        if render:
+            # Wide rivers spill one cell, so render from a copy with a river halo
+            hx0, hy0 = (max(0, x0 - 1), max(0, y0 - 1)) if world is not None else (x0, y0)
+            hx1, hy1 = (min(width, x1 + 1), min(height, y1 + 1)) if world is not None else (x1, y1)
+            pad = ((x0 - hx0, hx1 - x1), (y0 - hy0, hy1 - y1))
+            padded = {
+                'layers': {
+                    'terrain': np.pad(layers['terrain'], pad),
+                    'coast': np.pad(layers['coast'], pad),
+                    'resources': {name: np.pad(mask, pad) for name, mask in layers['resources'].items()}
+                },
+                'roads': np.pad(chunk['roads'], pad),
+                'river_widths': np.pad(chunk['river_widths'], pad) if world is None
+                                else world['river_widths'][hx0:hx1, hy0:hy1],
+                'settlements': {(x - hx0, y - hy0): kind for (x, y), kind in chunk['settlements'].items()}
+            }
+            with self.tracer.span('composite_world') as span:
+                chunk['image'] = self._composite_world(
+                    padded, (y0 - hy0, y1 - hy0), (x0 - hx0, x1 - hx0), span, self.atlas, (hx0, hy0)
+                )
+        return chunk
 
-    def generate_world(self):
-        # Create the world image
-        world_width = self.output_size[0] * self.tile_size
-        world_height = self.output_size[1] * self.tile_size
-        world_map = Image.new('RGBA', (world_width, world_height), (0, 0, 0, 0))
-
-        # Generate base maps
-        elevation_map = self.generate_noise_map(scale=100.0)
-        temperature_map = self.generate_noise_map(scale=100.0)
-        
-        # Generate features
-        rivers = self.generate_rivers(elevation_map, num_rivers=10)
-        coastal_tiles = self.generate_coastal_features(elevation_map)
-        resources = self.generate_resources(elevation_map, temperature_map)
-        
-        # Generate settlements with types
-        settlement_points = {}
-        for _ in range(random.randint(8, 12)):
-            while True:
-                x = random.randint(0, self.output_size[0]-1)
-                y = random.randint(0, self.output_size[1]-1)
-                if (elevation_map[x][y] > -0.2 and 
-                    elevation_map[x][y] < 0.6):
-                    settlement_type = self.determine_settlement_type(
-                        x, y, elevation_map, temperature_map
-                    )
-                    settlement_points[(x, y)] = settlement_type
-                    break
-
-        # Generate terrain with all features
-        for y in range(self.output_size[1]):
-            for x in range(self.output_size[0]):
-                # Get the appropriate tile based on terrain type
-                if (x, y) in rivers:
-                    tile = random.choice(self.tiles['river'])
-                elif (x, y) in coastal_tiles:
-                    tile = random.choice(self.tiles['coast'])
-                elif (x, y) in settlement_points:
-                    settlement_type = settlement_points[(x, y)]
-                    tile = random.choice(self.tiles['settlement'][settlement_type])
-                elif (x, y) in resources:
-                    resource_type = resources[(x, y)]
-                    tile = random.choice(self.tiles['resources'][resource_type])
-                else:
-                    elevation = elevation_map[x][y]
-                    temperature = temperature_map[x][y]
-                    biome = self.get_biome(elevation, temperature)
-                    tile = random.choice(self.tiles[biome])
-
-                # Convert tile to RGBA if it isn't already
-                if tile.mode != 'RGBA':
-                    tile = tile.convert('RGBA')
-                
-                try:
-                    world_map.paste(
-                        tile,
-                        (x * self.tile_size, y * self.tile_size),
-                        tile  # Use the tile itself as the mask
-                    )
-                except ValueError:
-                    # Fallback: paste without transparency if mask fails
-                    world_map.paste(
-                        tile,
-                        (x * self.tile_size, y * self.tile_size)
-                    )
-
-        # Generate roads between settlements with same error handling
-        settlement_locations = list(settlement_points.keys())
-        for i in range(len(settlement_locations)-1):
-            path = self.find_path(
-                settlement_locations[i],
-                settlement_locations[i+1],
-                elevation_map
+    def run_stage(self, name, params, inputs, compute):
+        """Return (key, result) for a pipeline stage, from the cache when possible."""
+        key = stage_key(name, params, inputs)
+        with self.tracer.span(f'stage:{name}') as span:
+            result = self.cache.load(key) if self.cache is not None else None
+            if result is None:
+                result = compute()
+                if self.cache is not None:
+                    self.cache.store(key, result)
+            else:
+                span.count('cache_hits')
+        return key, result
+
+    def plan_world(self, session=None):
+        """Generate every per-cell layer and feature of the world without rendering it.
+
+        Runs the stages noise -> classification -> hydrology -> settlements
+        -> roads. Each stage is keyed by the seed, the knobs it reads and
+        its upstream keys (see stagecache), so with a cache_dir a rerun only
+        recomputes the stages downstream of what changed.
+        """
+        width, height = self.output_size
+        fused = {}
+
+        def noise():
+            # On the worker pool, noise and classification come out of one pass
+            if session is not None:
+                elevation, temperature, fused['layers'] = session.generate_layers()
+                return elevation, temperature
+            return (
+                self.generate_noise_map(self.noise_scale, self.noise_octaves, base=0),
+                self.generate_noise_map(self.noise_scale, self.noise_octaves, base=1)
+            )
+
+        def classification():
+            if 'layers' in fused:
+                return fused['layers']
+            return self.classify_world(elevation_map, temperature_map)
+
+        noise_key, (elevation_map, temperature_map) = self.run_stage(
+            'noise',
+            {'seed': self.seed, 'size': [width, height],
+             'scale': self.noise_scale, 'octaves': self.noise_octaves},
+            [], noise
+        )
+        layers_key, layers = self.run_stage(
+            'classification', {'seed': self.seed}, [noise_key], classification
+        )
+        rivers_key, (river_mask, river_widths) = self.run_stage(
+            'hydrology', {'num_rivers': self.num_rivers}, [noise_key],
+            lambda: self.generate_rivers(elevation_map, self.num_rivers)
+        )
+        settlements_key, settlement_index = self.run_stage(
+            'settlements',
+            {'seed': self.seed, 'count': self.settlement_count,
+             'spacing': self.settlement_spacing},
+            [layers_key, rivers_key],
+            lambda: self.place_settlements(layers, river_mask, self.settlement_count)
+        )
+        settlement_points = dict(settlement_index.points)
+        roads_key, (road_mask, road_links) = self.run_stage(
+            'roads', {}, [noise_key, settlements_key],
+            lambda: self.generate_roads(settlement_points, elevation_map)
+        )
+
+        stages = {
+            'noise': noise_key,
+            'classification': layers_key,
+            'hydrology': rivers_key,
+            'settlements': settlements_key,
+            'roads': roads_key
+        }
+        navigation = None
+        if self.nav_cluster_size:
+            stages['navigation'], navigation = self.run_stage(
+                'navigation', {'cluster_size': self.nav_cluster_size}, [noise_key, roads_key],
+                lambda: self.build_navigation(elevation_map, road_mask, settlement_points)
+            )
+
+        fields = None
+        if self.distance_fields:
+            stages['fields'], fields = self.run_stage(
+                'fields', {}, [noise_key, layers_key, roads_key],
+                lambda: self.compute_fields(elevation_map, layers, road_mask, settlement_points)
+            )
+
+        viewsheds = None
+        if self.view_radius:
+            stages['viewsheds'], viewsheds = self.run_stage(
+                'viewsheds', {'radius': self.view_radius, 'watch_spacing': self.watch_spacing},
+                [noise_key, settlements_key],
+                lambda: self.compute_viewsheds(elevation_map, settlement_points)
             )
-            for x, y in path:
-                if self.tiles['road']:
-                    tile = random.choice(self.tiles['road'])
-                    if tile.mode != 'RGBA':
-                        tile = tile.convert('RGBA')
-                    try:
-                        world_map.paste(
-                            tile,
-                            (x * self.tile_size, y * self.tile_size),
-                            tile
-                        )
-                    except ValueError:
-                        world_map.paste(
-                            tile,
-                            (x * self.tile_size, y * self.tile_size)
-                        )
-
-        return world_map
-
-    def save_world(self, filename="world_map.png"):
-        world_map = self.generate_world()
-        world_map.save(filename)
+
+        return {
+            'elevation': elevation_map,
+            'temperature': temperature_map,
+            'layers': layers,
+            'rivers': river_mask,
+            'river_widths': river_widths,
+            'roads': road_mask,
+            'road_links': road_links,
+            'settlements': settlement_points,
+            'settlement_index': settlement_index,
+            'navigation': navigation,
+            'fields': fields,
+            'viewsheds': viewsheds,
+            'stages': stages
+        }
+
+    def render_world(self, world, session=None):
+        # Final stage: depends on the tileset as well as the planned layers
+        def render():
+            if session is not None:
+                return session.composite_world(world)
+            return self.composite_world(world)
+
+        stages = world['stages']
+        stages['render'], image = self.run_stage(
+            'render',
+            {'seed': self.seed, 'tileset': self.atlas.digest, 'tile_size': self.tile_size},
+            [stages[name] for name in ('classification', 'hydrology', 'settlements', 'roads')],
+            render
+        )
+        return image
+
+    def generate_world(self):
+        if self.workers > 1:
+            with ParallelSession(self, self.workers) as session:
+                world = self.plan_world(session)
+                return Image.fromarray(self.render_world(world, session), 'RGBA')
+        world = self.plan_world()
+        return Image.fromarray(self.render_world(world), 'RGBA')
+
+    def derived_sections(self, world):
+        """World file sections of the optional derived data: fields, travel graph, viewsheds."""
+        # Field grids are indexed [x, y] like the other layers; sections are (height, width)
+        sections = {name: np.ascontiguousarray(grid.T) for name, grid in (world.get('fields') or {}).items()}
+        if world.get('navigation'):
+            sections.update(world['navigation'].sections())
+        if world.get('viewsheds') is not None:
+            sections.update(world['viewsheds'].sections())
+        return sections
+
+    def save_world(self, filename="world_map.png", band_rows=None, data_filename=None,
+                   pyramid_dir=None, pyramid_tile=256, encoding=None):
+        """Generate the world and write the PNG, the .mwld data file and,
+        with pyramid_dir, zoomed-out levels cut into pyramid_tile-pixel tiles.
+
+        encoding holds PNGStreamWriter options (compress_level, filter_type,
+        strategy, threads); palette=True writes palette-indexed output
+        using the atlas's composite palette, falling back to RGBA when the
+        tiles have too many colours. Either way the PNG decodes to the same
+        pixels.
+        """
+        with self.tracer.span('save_world'):
+            if self.workers > 1:
+                with ParallelSession(self, self.workers) as session:
+                    return self._save_world(filename, band_rows, data_filename,
+                                            pyramid_dir, pyramid_tile, encoding, session)
+            return self._save_world(filename, band_rows, data_filename, pyramid_dir, pyramid_tile, encoding)
+
+    def png_writer(self, filename, encoding=None):
+        options = dict(encoding or {})
+        if options.pop('palette', False):
+            options['palette'] = self.atlas.composite_palette()
+        width, height = self.output_size
+        return PNGStreamWriter(filename, width * self.tile_size, height * self.tile_size, **options)
+
+    def _save_world(self, filename, band_rows, data_filename, pyramid_dir, pyramid_tile,
+                    encoding, session=None):
+        world = self.plan_world(session)
+        width, height = self.output_size
+
+        if band_rows is None and encoding is None:
+            image = Image.fromarray(self.render_world(world, session), 'RGBA')
+            with self.tracer.span('encode_png', rows=image.height):
+                image.save(filename)
+        elif band_rows is None:
+            image = self.render_world(world, session)
+            with self.tracer.span('encode_png', rows=image.shape[0]):
+                with self.png_writer(filename, encoding) as png:
+                    png.write_rows(image)
+        else:
+            # Streaming mode: only band_rows rows of tiles are ever rendered at once
+            bands = [(y0, min(y0 + band_rows, height)) for y0 in range(0, height, band_rows)]
+            if session is not None:
+                rendered = session.composite_bands(world, bands)
+            else:
+                rendered = ((rows, self.composite_world(world, rows)) for rows in bands)
+            with self.png_writer(filename, encoding) as png:
+                for _, band in rendered:
+                    with self.tracer.span('encode_png', rows=band.shape[0]):
+                        png.write_rows(band)
+
+        # Per-tile data for the game and tools, next to the picture
+        if data_filename is None:
+            data_filename = os.path.splitext(filename)[0] + '.mwld'
+        with self.tracer.span('write_world_file'):
+            write_world_file(data_filename, world, width, height, self.seed, self.derived_sections(world))
+
+        if pyramid_dir is not None:
+            with self.tracer.span('write_pyramid'):
+                write_pyramid(self, world, pyramid_dir, pyramid_tile)
+        return world
 
 # Usage
 if __name__ == "__main__":